@@ -1,11 +1,45 @@
+import argparse
 import os
 import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
 from pathlib import Path
 
+from video_probe import probe
+
+# PyAV lets a worker decode a tier once and feed every QP encoder in-process
+try:
+    import av
+    has_pyav = True
+except ImportError:
+    has_pyav = False
+
 # Directory setup
 SOURCE_DIR = Path("video_source")
 OUTPUT_DIR = Path("av1_encoded_videos")
 
+# SVT-AV1 preset (0 = slowest/best, 13 = fastest)
+SVT_PRESET = 8
+
+# SVT-AV1 tiling per resolution as (log2 tile columns, log2 tile rows): 2x1 at 1080p, 4x2 at 2160p.
+# 360p and 720p stay single-tile.
+SVT_TILES = {
+    "1080p": (1, 0),
+    "2160p": (2, 1)
+}
+
+# FAST_BATCH=1 trades compression efficiency for speed: low-delay prediction (no B-frames)
+# and a fixed 60-frame keyframe interval. Leave unset for reportable quality runs.
+FAST_BATCH = os.environ.get("FAST_BATCH") == "1"
+FAST_BATCH_SVT_PARAMS = "pred-struct=1:keyint=60"
+
+# Threads given to each ffmpeg process when encodes run in parallel
+THREADS_PER_JOB = 4
+
+# Hardware AV1 encoders, in order of preference
+HW_ENCODERS = ["av1_nvenc", "av1_qsv", "av1_vaapi"]
+VAAPI_DEVICE = "/dev/dri/renderD128"
+
 # CRF values per resolution
 QP_VALUES = {
     "360p": [24, 30],
@@ -21,52 +55,275 @@ RESOLUTIONS = {
     "2160p": "3840x2160"
 }
 
+# ffmpeg's encoder table, read once at import instead of on every check
+try:
+    _ENCODERS = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True).stdout
+    HAS_FFMPEG = True
+except Exception:
+    _ENCODERS = ""
+    HAS_FFMPEG = False
+HAS_SVTAV1 = "libsvtav1" in _ENCODERS
+
 def check_ffmpeg():
-    try:
-        result = subprocess.run(["ffmpeg", "-encoders"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if "libaom-av1" not in result.stdout:
-            print("[✗] FFmpeg found but AV1 encoder (libaom-av1) is not available.")
-            return False
-        return True
-    except:
+    if not HAS_FFMPEG:
         print("[✗] FFmpeg not found. Please install it.")
         return False
+    if not HAS_SVTAV1:
+        print("[✗] FFmpeg found but AV1 encoder (libsvtav1) is not available.")
+        return False
+    return True
+
+def pick_hw_encoder():
+    """Returns the first hardware AV1 encoder ffmpeg offers, or None"""
+    for encoder in HW_ENCODERS:
+        if encoder in _ENCODERS:
+            return encoder
+    return None
+
+def hw_encoder_args(encoder, width, height, qp):
+    """Returns (input args, video filter, codec args) keeping decode, scale and encode on the GPU"""
+    if encoder.endswith("_nvenc"):
+        return (
+            ["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"],
+            f"scale_cuda={width}:{height}",
+            ["-c:v", encoder, "-preset", "p4", "-tune", "hq", "-rc", "vbr", "-cq", str(qp), "-b:v", "0"]
+        )
+    if encoder.endswith("_qsv"):
+        return (
+            ["-hwaccel", "qsv", "-hwaccel_output_format", "qsv"],
+            f"scale_qsv=w={width}:h={height}",
+            ["-c:v", encoder, "-global_quality", str(qp)]
+        )
+    return (
+        ["-vaapi_device", VAAPI_DEVICE],
+        f"format=nv12,hwupload,scale_vaapi=w={width}:h={height}",
+        ["-c:v", encoder, "-rc_mode", "CQP", "-qp", str(qp)]
+    )
 
 def get_exact_framerate(filepath):
+    """Returns exact FPS (as float) from ffprobe"""
     try:
-        result = subprocess.run([
-            "ffprobe", "-v", "error",
-            "-select_streams", "v:0",
-            "-show_entries", "stream=r_frame_rate",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            str(filepath)
-        ], capture_output=True, text=True)
-
-        fps_raw = result.stdout.strip()
-        if "/" in fps_raw:
-            num, denom = map(int, fps_raw.split("/"))
-            return round(num / denom, 6)
-        return round(float(fps_raw), 6)
+        return probe(filepath)["fps"]
     except Exception as e:
         print(f"[!] Could not get FPS for {filepath.name}: {e}")
         return None
 
 def get_duration(filepath):
     try:
-        result = subprocess.run([
-            "ffprobe", "-v", "error",
-            "-select_streams", "v:0",
-            "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            str(filepath)
-        ], capture_output=True, text=True)
-        return round(float(result.stdout.strip()), 3)
+        return probe(filepath)["duration"]
     except Exception as e:
         print(f"[!] Could not get duration for {filepath.name}: {e}")
         return None
 
-def encode_av1():
-    if not check_ffmpeg():
+def get_svt_params(res_name, threads):
+    # lp bounds SVT-AV1's thread pool to this job's share of the cores so parallel workers don't oversubscribe
+    svt_params = f"tune=0:fast-decode=1:lp={threads}"
+    if res_name in SVT_TILES:
+        tile_columns, tile_rows = SVT_TILES[res_name]
+        svt_params += f":tile-columns={tile_columns}:tile-rows={tile_rows}"
+    if FAST_BATCH:
+        svt_params += f":{FAST_BATCH_SVT_PARAMS}"
+    return svt_params
+
+def encode_tier(job):
+    """Encodes every pending QP of one (source, resolution) pair in a single ffmpeg run.
+    Decode and scale happen once and fan out to one encoder per QP. Runs inside a worker process."""
+    src, input_path, original_fps, duration, res_name, width, height, qp_list, hw_encoder, threads = job
+
+    svt_params = get_svt_params(res_name, threads)
+
+    output_args = []
+    output_names = []
+    for qp in qp_list:
+        output_name = f"{src.stem}_av1_{res_name}_qp{qp}.mkv"
+        output_path = OUTPUT_DIR / output_name
+        if output_path.exists():
+            print(f"[Skip] {output_name} already exists")
+            continue
+
+        if hw_encoder:
+            input_args, video_filter, codec_args = hw_encoder_args(hw_encoder, width, height, qp)
+            filter_args = ["-vf", video_filter, "-r", str(original_fps), "-t", str(duration)]
+        else:
+            input_args = []
+            filter_args = ["-vf", f"scale={width}:{height}", "-r", str(original_fps), "-t", str(duration)]
+            codec_args = [
+                "-c:v", "libsvtav1",
+                "-preset", str(SVT_PRESET),
+                "-crf", str(qp),
+                "-svtav1-params", svt_params,
+                "-pix_fmt", "yuv420p"
+            ]
+
+        output_args += ["-map", "0:v", *filter_args, *codec_args, "-threads", str(threads), str(output_path)]
+        output_names.append(output_name)
+
+    if not output_names:
+        return []
+
+    print(f"[Encode] {', '.join(output_names)}")
+
+    ffmpeg_cmd = [
+        "ffmpeg", "-y", "-loglevel", "error", "-nostats",
+        "-threads", str(threads),
+        *input_args,
+        "-i", str(input_path),
+        *output_args
+    ]
+
+    result = subprocess.run(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode == 0:
+        return [(output_name, "done", None) for output_name in output_names]
+
+    # A failed run leaves every output of the command incomplete
+    error_msg = result.stderr.decode("utf-8", errors="replace")[:300]
+    for output_name in output_names:
+        (OUTPUT_DIR / output_name).unlink(missing_ok=True)
+    return [(output_name, "error", error_msg) for output_name in output_names]
+
+def encode_source(job):
+    """Encodes every pending (resolution, QP) of one source in a single ffmpeg run.
+    The source is decoded once and split into one scaler per resolution, each feeding its QP encoders."""
+    src, original_fps, duration, pending, threads = job
+
+    # pending maps resolution -> QPs still to encode
+    resolutions = [res_name for res_name in RESOLUTIONS if pending.get(res_name)]
+    # The job's threads are shared out by pixel count, so the 4K encoders (the critical path) get
+    # enough lp for their tiles while all encoders of the graph together stay within the job's share
+    pixels = {res_name: int(RESOLUTIONS[res_name].split("x")[0]) * int(RESOLUTIONS[res_name].split("x")[1])
+              for res_name in resolutions}
+    total_pixels = sum(pixels[res_name] * len(pending[res_name]) for res_name in resolutions)
+    encoder_threads = {res_name: max(1, threads * pixels[res_name] // total_pixels) for res_name in resolutions}
+
+    graph = [f"[0:v]split={len(resolutions)}" + "".join(f"[s{res_name}]" for res_name in resolutions)]
+    for res_name in resolutions:
+        width, height = RESOLUTIONS[res_name].split("x")
+        # A filter output feeds one encoder only, so each scaled stream is split again per QP
+        labels = "".join(f"[v{res_name}_{qp}]" for qp in pending[res_name])
+        graph.append(f"[s{res_name}]scale={width}:{height},split={len(pending[res_name])}{labels}")
+
+    output_args = []
+    output_names = []
+    for res_name in resolutions:
+        svt_params = get_svt_params(res_name, encoder_threads[res_name])
+        for qp in pending[res_name]:
+            output_name = f"{src.stem}_av1_{res_name}_qp{qp}.mkv"
+            output_args += [
+                "-map", f"[v{res_name}_{qp}]",
+                "-r", str(original_fps),
+                "-c:v", "libsvtav1",
+                "-preset", str(SVT_PRESET),
+                "-crf", str(qp),
+                "-svtav1-params", svt_params,
+                "-pix_fmt", "yuv420p",
+                str(OUTPUT_DIR / output_name)
+            ]
+            output_names.append(output_name)
+
+    print(f"[Encode] {src.name} → {len(output_names)} output(s)")
+
+    ffmpeg_cmd = [
+        "ffmpeg", "-y", "-loglevel", "error", "-nostats",
+        "-threads", str(threads),
+        "-t", str(duration),
+        "-i", str(src),
+        "-filter_complex", ";".join(graph),
+        *output_args
+    ]
+
+    result = subprocess.run(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode == 0:
+        return [(output_name, "done", None) for output_name in output_names]
+
+    # A failed run leaves every output of the command incomplete
+    error_msg = result.stderr.decode("utf-8", errors="replace")[:300]
+    for output_name in output_names:
+        (OUTPUT_DIR / output_name).unlink(missing_ok=True)
+    return [(output_name, "error", error_msg) for output_name in output_names]
+
+def encode_tier_pyav(job):
+    """Same as encode_tier, but decodes and encodes in-process with PyAV instead of spawning ffmpeg.
+    Software (libsvtav1) only. Runs inside a worker process."""
+    src, input_path, original_fps, duration, res_name, width, height, qp_list, hw_encoder, threads = job
+    width, height = int(width), int(height)
+
+    pending = []
+    for qp in qp_list:
+        output_name = f"{src.stem}_av1_{res_name}_qp{qp}.mkv"
+        if (OUTPUT_DIR / output_name).exists():
+            print(f"[Skip] {output_name} already exists")
+            continue
+        pending.append((qp, output_name))
+
+    if not pending:
+        return []
+
+    print(f"[Encode] {', '.join(name for _, name in pending)}")
+
+    outputs = []
+    try:
+        with av.open(str(input_path)) as container:
+            in_stream = container.streams.video[0]
+            in_stream.thread_type = "AUTO"
+            rate = Fraction(str(original_fps)).limit_denominator(1001)
+
+            for qp, output_name in pending:
+                out_container = av.open(str(OUTPUT_DIR / output_name), mode="w")
+                out_stream = out_container.add_stream("libsvtav1", rate=rate)
+                out_stream.width = width
+                out_stream.height = height
+                out_stream.pix_fmt = "yuv420p"
+                out_stream.codec_context.time_base = 1 / rate
+                out_stream.options = {
+                    "preset": str(SVT_PRESET),
+                    "crf": str(qp),
+                    "svtav1-params": get_svt_params(res_name, threads)
+                }
+                outputs.append((out_container, out_stream))
+
+            max_frames = round(duration * original_fps)
+            for index, frame in enumerate(container.decode(in_stream)):
+                if index >= max_frames:
+                    break
+                if frame.width != width or frame.height != height or frame.format.name != "yuv420p":
+                    frame = frame.reformat(width=width, height=height, format="yuv420p")
+                frame.pts = index
+                frame.time_base = 1 / rate
+                for out_container, out_stream in outputs:
+                    for packet in out_stream.encode(frame):
+                        out_container.mux(packet)
+
+            # Flush the encoders
+            for out_container, out_stream in outputs:
+                for packet in out_stream.encode():
+                    out_container.mux(packet)
+    except Exception as e:
+        for out_container, _ in outputs:
+            out_container.close()
+        for _, output_name in pending:
+            (OUTPUT_DIR / output_name).unlink(missing_ok=True)
+        return [(output_name, "error", str(e)) for _, output_name in pending]
+
+    for out_container, _ in outputs:
+        out_container.close()
+    return [(output_name, "done", None) for _, output_name in pending]
+
+def encode_av1(use_hw=False, workers=None, use_pyav=False):
+    if use_pyav and not has_pyav:
+        print("[!] PyAV not found (pip install av), falling back to ffmpeg.")
+        use_pyav = False
+    if use_pyav and use_hw:
+        print("[!] --pyav only supports the software encoder, ignoring --hw.")
+        use_hw = False
+
+    hw_encoder = pick_hw_encoder() if use_hw else None
+    if use_hw:
+        if hw_encoder:
+            print(f"[i] Using hardware encoder {hw_encoder}")
+        else:
+            print("[!] No hardware AV1 encoder found, falling back to libsvtav1.")
+
+    if hw_encoder is None and not check_ffmpeg():
         return
 
     SOURCE_DIR.mkdir(parents=True, exist_ok=True)
@@ -81,52 +338,66 @@ def encode_av1():
 
     print(f"[i] Found {len(source_files)} video file(s)")
 
+    # The ffmpeg software path runs one split graph per source; hardware and PyAV run one job per tier
+    per_source = hw_encoder is None and not use_pyav
+    cpu_count = os.cpu_count() or 1
+    max_workers = len(source_files) if per_source else len(RESOLUTIONS)
+    workers = max(1, min(workers or cpu_count // THREADS_PER_JOB, max_workers))
+    threads = max(1, cpu_count // workers)
+    print(f"[i] Running encodes on {workers} worker(s), {threads} thread(s) each")
+
+    # One directory listing instead of a stat() per prospective output
+    existing = {entry.name for entry in os.scandir(OUTPUT_DIR) if entry.is_file()}
+
+    jobs = []
     for src in source_files:
-        print(f"\n[i] Processing {src.name}")
+        pending = {
+            res_name: [qp for qp in QP_VALUES[res_name]
+                       if f"{src.stem}_av1_{res_name}_qp{qp}.mkv" not in existing]
+            for res_name in RESOLUTIONS
+        }
+        if not any(pending.values()):
+            print(f"[Skip] All encodes for {src.name} already exist")
+            continue
+
         original_fps = get_exact_framerate(src)
         duration = get_duration(src)
 
         if original_fps is None or duration is None:
-            print("[!] Skipping due to FPS/duration read error.")
+            print(f"[!] Skipping {src.name} due to FPS/duration read error.")
+            continue
+
+        if per_source:
+            jobs.append((src, original_fps, duration, pending, threads))
             continue
 
-        for res_name, res_value in RESOLUTIONS.items():
-            width, height = res_value.split("x")
-            qp_list = QP_VALUES[res_name]
-
-            for qp in qp_list:
-                output_name = f"{src.stem}_av1_{res_name}_qp{qp}.mkv"
-                output_path = OUTPUT_DIR / output_name
-
-                if output_path.exists():
-                    print(f"[Skip] {output_name} already exists")
-                    continue
-
-                print(f"[Encode] {output_name}")
-
-                ffmpeg_cmd = [
-                    "ffmpeg", "-y",
-                    "-i", str(src),
-                    "-vf", f"scale={width}:{height}",
-                    "-r", str(original_fps),
-                    "-t", str(duration),
-                    "-c:v", "libaom-av1",
-                    "-crf", str(qp),
-                    "-b:v", "0",
-                    "-cpu-used", "6",
-                    "-pix_fmt", "yuv420p",
-                    str(output_path)
-                ]
-
-                result = subprocess.run(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                if result.returncode == 0:
+        for res_name, qp_list in pending.items():
+            if not qp_list:
+                continue
+            width, height = RESOLUTIONS[res_name].split("x")
+            jobs.append((src, src, original_fps, duration, res_name, width, height, qp_list, hw_encoder, threads))
+
+    if per_source:
+        worker = encode_source
+    else:
+        worker = encode_tier_pyav if use_pyav else encode_tier
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for results in executor.map(worker, jobs):
+            for output_name, status, error_msg in results:
+                if status == "done":
+                    existing.add(output_name)
                     print(f"[✓] Encoded: {output_name}")
                 else:
-                    error_msg = result.stderr.decode("utf-8", errors="replace")[:300]
                     print(f"[✗] Error encoding {output_name}:\n{error_msg}\n")
 
     print("\n[✓] AV1 encoding complete.")
     print(f"[i] Encoded videos saved in '{OUTPUT_DIR}'")
 
 if __name__ == "__main__":
-    encode_av1()
+    parser = argparse.ArgumentParser(description="Encode source videos with AV1")
+    parser.add_argument("--hw", action="store_true", help="use a hardware AV1 encoder (NVENC/QSV/VAAPI) if available")
+    parser.add_argument("--jobs", type=int, default=None, help="number of parallel encodes (default: CPU cores / THREADS_PER_JOB)")
+    parser.add_argument("--pyav", action="store_true", help="encode in-process with PyAV instead of spawning ffmpeg per tier")
+    args = parser.parse_args()
+    encode_av1(use_hw=args.hw, workers=args.jobs, use_pyav=args.pyav)
\ No newline at end of file
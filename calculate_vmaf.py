@@ -1,13 +1,19 @@
+import argparse
 import os
+import re
 import subprocess
+import tempfile
 import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")  # Plots are only saved to files; no GUI backend needed
 import matplotlib.pyplot as plt
 import seaborn as sns
 from pathlib import Path
-from scipy.stats import pearsonr
 import numpy as np
-from sklearn.metrics import mean_squared_error
+
+from video_probe import PHYSICAL_CORES, probe
 
 # Try to import adjustText for better label placement
 try:
@@ -18,11 +24,30 @@ except ImportError:
     print("[INFO] Text labels may overlap in plots.")
     has_adjust_text = False
 
+# adjust_text's layout is quadratic in the number of labels; above this many, labels keep their fixed offsets
+ADJUST_TEXT_LIMIT = 30
+
+# Encodes scored by one ffmpeg run with --batch; every one adds a decoder and a libvmaf instance to the graph
+VMAF_BATCH_SIZE = 12
+
+
+def run_ffmpeg(cmd):
+    """Runs cmd with stdout discarded and stderr spooled to a temporary file.
+    Returns (returncode, stderr); stderr is only read and decoded when the run fails."""
+    with tempfile.SpooledTemporaryFile(max_size=64 * 1024) as err:
+        returncode = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=err).returncode
+        if returncode == 0:
+            return returncode, ""
+        err.seek(0)
+        return returncode, err.read().decode('utf-8', errors='replace')
+
 
 class VMAFAnalyzer:
-    def __init__(self, codec="vvc"):
+    def __init__(self, codec="vvc", workers=None, subsample=1, vmaf_threads=4, batch=False, force=False):
         # Set codec
         self.codec = codec.lower()  # vvc, av1, h265, etc.
+        # Encoded files are named <source>_<codec>_<height>p_qp<qp>
+        self._name_re = re.compile(rf"_{re.escape(self.codec)}_(\d+)p_qp(\d+)$")
         
         # Base directories
         self.base_dir = Path(f"vmaf_analysis_{self.codec}")
@@ -58,6 +83,17 @@ class VMAFAnalyzer:
         # VMAF comparison settings
         self.comparison_resolution = "3840x2160"
         self.comparison_fps = "60"
+        # Score every Nth frame. Subsampling shifts the motion feature slightly,
+        # so keep 1 for reportable scores and raise it only for dev runs.
+        self.vmaf_subsample = subsample
+        
+        # Parallel VMAF runs; each ffmpeg/libvmaf gets a fixed thread pool so workers don't oversubscribe
+        self.threads_per_vmaf = vmaf_threads
+        self.workers = workers or max(1, PHYSICAL_CORES // self.threads_per_vmaf)
+        # Score all encodes of a source in one ffmpeg run that decodes and scales the reference once
+        self.batch = batch
+        # Recompute every score even when an up-to-date log exists
+        self.force = force
         
         # Encoding settings
         self.resolutions = [360, 720, 1080, 2160]
@@ -79,36 +115,111 @@ class VMAFAnalyzer:
             return False
         return True
 
-    def run_vmaf(self, reference_path, encoded_path, json_path):
+    def comparison_chain(self, video_path):
+        """Filters bringing a video to the comparison size and rate; skips whichever already matches"""
+        try:
+            info = probe(video_path)
+        except Exception:
+            info = {}
+        
+        filters = []
+        if f"{info.get('width')}x{info.get('height')}" != self.comparison_resolution:
+            filters.append(f"scale={self.comparison_resolution}:flags=lanczos")
+        if not info.get("fps") or abs(info["fps"] - float(self.comparison_fps)) > 0.01:
+            filters.append(f"fps={self.comparison_fps}")
+        return ",".join(filters) or "null"
+
+    def vmaf_log_path(self, vmaf_logs_dir, encoded_path):
+        """Per-frame log of one encode; the subsampling is part of the name, so a dev run's
+        subsampled log is never reused for a full-rate score or vice versa"""
+        return vmaf_logs_dir / f"{Path(encoded_path).stem}_ss{self.vmaf_subsample}.csv"
+
+    def log_is_current(self, log_path, source_path, encoded_path):
+        """True if a VMAF log exists and is newer than both videos and the model it was computed from"""
+        try:
+            log_mtime = log_path.stat().st_mtime_ns
+            return log_mtime >= max(Path(source_path).stat().st_mtime_ns, Path(encoded_path).stat().st_mtime_ns,
+                                    self.vmaf_model_path.stat().st_mtime_ns)
+        except OSError:
+            return False
+
+    def run_vmaf(self, reference_path, encoded_path, log_path):
         """Run VMAF analysis with upscaling to 4K"""
         filter_complex_cmd = (
-            f"[0:v]scale={self.comparison_resolution}:flags=lanczos,fps={self.comparison_fps}[main]; "
-            f"[1:v]scale={self.comparison_resolution}:flags=lanczos,fps={self.comparison_fps}[ref]; "
+            f"[0:v]{self.comparison_chain(encoded_path)}[main]; "
+            f"[1:v]{self.comparison_chain(reference_path)}[ref]; "
             f"[main][ref]libvmaf=model='path={str(self.vmaf_model_path).replace(os.sep, '/')}'"
-            f":log_fmt=json:log_path='{str(json_path).replace(os.sep, '/')}'"
+            f":n_threads={self.threads_per_vmaf}:n_subsample={self.vmaf_subsample}"
+            f":log_fmt=csv:log_path='{str(log_path).replace(os.sep, '/')}'"
         )
         
         ffmpeg_cmd = [
-            "ffmpeg",
+            "ffmpeg", "-loglevel", "error", "-nostats",  # Only errors reach stderr; the score comes from the log
+            # -threads is per input, so both decoders get it; the scalers share -filter_complex_threads
+            "-threads", str(self.threads_per_vmaf),
             "-i", str(encoded_path),    # Input 0: Distorted video
+            "-threads", str(self.threads_per_vmaf),
             "-i", str(reference_path),  # Input 1: Reference video
+            "-filter_complex_threads", str(self.threads_per_vmaf),
             "-lavfi", filter_complex_cmd,
             "-f", "null", "-"  # Output to null, we only care about VMAF logs
         ]
         
         try:
-            process = subprocess.run(ffmpeg_cmd, capture_output=True, text=True, encoding='utf-8', errors='replace')
-            if process.returncode != 0:
+            returncode, stderr = run_ffmpeg(ffmpeg_cmd)
+            if returncode != 0:
                 print(f"ERROR running FFmpeg for {encoded_path}:")
-                print(process.stderr)
+                print(stderr[-4096:])
                 return False
             return True
         except Exception as e:
             print(f"Exception during VMAF calculation: {e}")
             return False
 
-    def get_bitrate(self, video_path):
-        """Get video bitrate using ffprobe"""
+    def run_vmaf_batch(self, reference_path, pending):
+        """Run VMAF for several (encoded_path, log_path) pairs of one reference in a single ffmpeg process.
+        The reference is decoded and upscaled once and split to one libvmaf instance per encode."""
+        model_path = str(self.vmaf_model_path).replace(os.sep, '/')
+        # The instances run side by side, so they share the cores instead of taking vmaf_threads each
+        n_threads = max(1, PHYSICAL_CORES // len(pending))
+        
+        inputs = ["-i", str(reference_path)]  # Input 0: Reference video
+        graph = [f"[0:v]{self.comparison_chain(reference_path)},split={len(pending)}" + "".join(f"[ref{i}]" for i in range(len(pending)))]
+        outputs = []
+        for i, (encoded_path, log_path) in enumerate(pending):
+            inputs += ["-i", str(encoded_path)]  # Inputs 1..N: Distorted videos
+            graph.append(f"[{i + 1}:v]{self.comparison_chain(encoded_path)}[main{i}]")
+            graph.append(
+                f"[main{i}][ref{i}]libvmaf=model='path={model_path}'"
+                f":n_threads={n_threads}:n_subsample={self.vmaf_subsample}"
+                f":log_fmt=csv:log_path='{str(log_path).replace(os.sep, '/')}'[vmaf{i}]"
+            )
+            outputs += ["-map", f"[vmaf{i}]"]
+        
+        ffmpeg_cmd = [
+            "ffmpeg", "-loglevel", "error", "-nostats",
+            *inputs,
+            "-filter_complex", "; ".join(graph),
+            *outputs,
+            "-f", "null", "-"  # Every libvmaf output goes to the null muxer; only the logs matter
+        ]
+        
+        try:
+            returncode, stderr = run_ffmpeg(ffmpeg_cmd)
+            if returncode != 0:
+                print(f"ERROR running batched FFmpeg for {reference_path}:")
+                print(stderr[-4096:])
+                return False
+            return True
+        except Exception as e:
+            print(f"Exception during batched VMAF calculation: {e}")
+            return False
+
+    def get_bitrate(self, video_path, duration=None):
+        """Get video bitrate in kbps from file size and duration, falling back to ffprobe"""
+        if duration:
+            return os.path.getsize(video_path) * 8 / 1000 / duration
+        
         probe_cmd = [
             "ffprobe", "-v", "error", "-select_streams", "v:0",
             "-show_entries", "format=bit_rate", "-of", "json", str(video_path)
@@ -125,19 +236,72 @@ class VMAFAnalyzer:
         
         return None
 
-    def extract_vmaf_score(self, json_path):
-        """Extract VMAF score from JSON result file"""
+    def extract_vmaf_score(self, log_path):
+        """Extract mean, harmonic-mean and 5th-percentile VMAF scores from the per-frame CSV log"""
         try:
-            with open(json_path, 'r', encoding='utf-8') as f:
-                vmaf_data = json.load(f)
-            
-            vmaf_scores = [frame['metrics']['vmaf'] for frame in vmaf_data['frames']]
-            avg_vmaf = sum(vmaf_scores) / len(vmaf_scores) if vmaf_scores else 0
-            return avg_vmaf
+            # Only the vmaf column is parsed; the CSV log carries no pooled metrics, so they are computed here
+            vmaf_scores = pd.read_csv(log_path, usecols=['vmaf'])['vmaf'].to_numpy(dtype=np.float64)
+            if vmaf_scores.size == 0:
+                return 0, 0, 0
+            perc5 = float(np.percentile(vmaf_scores, 5))
+            # Same harmonic mean as libvmaf's pooling (offset by 1 so zero scores stay finite)
+            harmonic_mean = 1.0 / np.mean(1.0 / (vmaf_scores + 1.0)) - 1.0
+            return float(vmaf_scores.mean()), float(harmonic_mean), perc5
         except Exception as e:
-            print(f"Error extracting VMAF score from {json_path}: {e}")
+            print(f"Error extracting VMAF score from {log_path}: {e}")
             return None
 
+    def process_encoded(self, job):
+        """Run VMAF for one encoded video and collect its result row. Runs inside a worker process."""
+        source_path, encoded_file, vmaf_logs_dir, ref_duration, log_fresh = job
+        
+        # Parse resolution and QP from filename
+        match = self._name_re.search(encoded_file.stem)
+        if not match:
+            print(f"Skipping '{encoded_file.name}': Could not parse resolution or QP.")
+            return None
+        resolution, qp_value = int(match[1]), int(match[2])
+        
+        # Set up CSV log path
+        log_path = self.vmaf_log_path(vmaf_logs_dir, encoded_file)
+        
+        # Reuse the log the batch pass just wrote, or (without --force) one of a previous run;
+        # a missing, stale or unreadable log is (re)computed
+        reuse = log_fresh or (not self.force and self.log_is_current(log_path, source_path, encoded_file))
+        scores = self.extract_vmaf_score(log_path) if reuse else None
+        if scores is not None:
+            print(f"Reusing existing VMAF log for {encoded_file.name}")
+        else:
+            print(f"Running VMAF for {encoded_file.name} (Resolution: {resolution}p, QP: {qp_value})...")
+            
+            # Run VMAF calculation
+            success = self.run_vmaf(source_path, encoded_file, log_path)
+            
+            if not success or not log_path.exists():
+                print(f"VMAF calculation failed for {encoded_file.name}")
+                return None
+            
+            # Extract VMAF score
+            scores = self.extract_vmaf_score(log_path)
+            if scores is None:
+                return None
+        vmaf_score, vmaf_harmonic_mean, vmaf_perc5 = scores
+        
+        # Get bitrate
+        bitrate_kbps = self.get_bitrate(encoded_file, ref_duration)
+        
+        print(f"VMAF score for {encoded_file.name}: {vmaf_score:.2f}")
+        
+        return {
+            "video": str(encoded_file),
+            "resolution": resolution,
+            "qp": qp_value,
+            "bitrate_kbps": bitrate_kbps,
+            "vmaf": vmaf_score,
+            "vmaf_harmonic_mean": vmaf_harmonic_mean,
+            "vmaf_perc5": vmaf_perc5
+        }
+
     def analyze_videos(self):
         """Process all videos and calculate VMAF scores"""
         if not self.verify_setup():
@@ -153,89 +317,124 @@ class VMAFAnalyzer:
             print(f"No source videos found in {self.source_dir}")
             return
         
-        # Process each source video
+        if not self.encoded_dir.is_dir():
+            print(f"No encoded videos found in {self.encoded_dir}")
+            return
+        
+        # Read the encoded directory once; every source looks its encodes up by stem
+        encoded_by_stem = {}
+        with os.scandir(self.encoded_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    encoded_by_stem.setdefault(os.path.splitext(entry.name)[0].lower(), []).append(Path(entry.path))
+        
+        # Collect every source's jobs first so one pool keeps all workers busy across sources
+        jobs_by_source = {}
         for source_name, source_path in source_videos.items():
-            print(f"\nProcessing source video: {source_name}")
-            
-            # Create output directories for this source
-            vmaf_logs_dir = self.json_dir / f"{source_name}"
-            vmaf_logs_dir.mkdir(parents=True, exist_ok=True)
-            
-            # Find encoded videos for this source
-            encoded_files = []
-            for res in self.resolutions:
-                for qp in self.qp_values:
-                    pattern = f"{source_name}_{self.codec}_{res}p_qp{qp}.*"
-                    matches = list(self.encoded_dir.glob(pattern))
-                    if matches:
-                        encoded_files.extend(matches)
-            
-            if not encoded_files:
-                print(f"No encoded videos found for {source_name}")
-                continue
-                
-            print(f"Found {len(encoded_files)} encoded videos for {source_name}")
+            jobs = self._prepare_source(source_name, source_path, encoded_by_stem)
+            if jobs:
+                jobs_by_source[source_name] = jobs
+        
+        if not jobs_by_source:
+            return
+        
+        # Run VMAF and parse its log for every encoded video in parallel, collecting rows as they finish;
+        # a source's CSV and plots are written as soon as its last encode is scored
+        vmaf_results = {source_name: [] for source_name in jobs_by_source}
+        remaining = {source_name: len(jobs) for source_name, jobs in jobs_by_source.items()}
+        total_jobs = sum(remaining.values())
+        with ProcessPoolExecutor(max_workers=min(self.workers, total_jobs)) as executor:
+            futures = {executor.submit(self.process_encoded, job): source_name
+                       for source_name, jobs in jobs_by_source.items() for job in jobs}
+            for future in as_completed(futures):
+                source_name = futures[future]
+                result = future.result()
+                if result:
+                    vmaf_results[source_name].append(result)
+                remaining[source_name] -= 1
+                if remaining[source_name] == 0:
+                    self._finish_source(source_name, source_videos[source_name], vmaf_results[source_name])
+
+    def _prepare_source(self, source_name, source_path, encoded_by_stem):
+        """Find the encodes of one source and return its VMAF jobs; with --batch, scores them here first"""
+        print(f"\nProcessing source video: {source_name}")
+        
+        # Create output directories for this source
+        vmaf_logs_dir = self.json_dir / f"{source_name}"
+        vmaf_logs_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Find encoded videos for this source
+        encoded_files = []
+        for res in self.resolutions:
+            for qp in self.qp_values:
+                encoded_files.extend(encoded_by_stem.get(f"{source_name}_{self.codec}_{res}p_qp{qp}", []))
+        
+        if not encoded_files:
+            print(f"No encoded videos found for {source_name}")
+            return []
             
-            # Process each encoded video
-            vmaf_results = []
-            for encoded_file in encoded_files:
-                # Parse resolution and QP from filename
-                parts = encoded_file.stem.split('_')
-                try:
-                    # Find resolution part (e.g., '360p')
-                    res_part = next(p for p in parts if p.endswith('p') and p[:-1].isdigit())
-                    resolution = int(res_part.replace('p', ''))
-                    
-                    # Find QP part (e.g., 'qp24')
-                    qp_part = next(p for p in parts if p.startswith('qp') and p[2:].isdigit())
-                    qp_value = int(qp_part.replace('qp', ''))
-                except (StopIteration, ValueError) as e:
-                    print(f"Skipping '{encoded_file.name}': Could not parse resolution or QP. Error: {e}")
-                    continue
-                
-                # Set up JSON log path
-                json_log_path = vmaf_logs_dir / f"{encoded_file.stem}.json"
-                
-                print(f"Running VMAF for {encoded_file.name} (Resolution: {resolution}p, QP: {qp_value})...")
-                
-                # Run VMAF calculation
-                success = self.run_vmaf(source_path, encoded_file, json_log_path)
-                
-                if not success or not json_log_path.exists():
-                    print(f"VMAF calculation failed for {encoded_file.name}")
-                    continue
-                
-                # Extract VMAF score
-                vmaf_score = self.extract_vmaf_score(json_log_path)
-                if vmaf_score is None:
-                    continue
-                
-                # Get bitrate
-                bitrate_kbps = self.get_bitrate(encoded_file)
-                
-                # Add to results
-                vmaf_results.append({
-                    "video": str(encoded_file),
-                    "resolution": resolution,
-                    "qp": qp_value,
-                    "bitrate_kbps": bitrate_kbps,
-                    "vmaf": vmaf_score
-                })
-                
-                print(f"VMAF score: {vmaf_score:.2f}")
+        print(f"Found {len(encoded_files)} encoded videos for {source_name}")
+        
+        # Encodes share the reference's duration, so one probe gives every bitrate
+        try:
+            ref_duration = probe(source_path)["duration"]
+        except Exception as e:
+            print(f"Could not get duration of {source_path.name}, probing each encode instead: {e}")
+            ref_duration = None
+        
+        # Encodes whose logs the batch pass writes now; their jobs only parse the log
+        fresh = set()
+        if self.batch:
+            pending = [(f, self.vmaf_log_path(vmaf_logs_dir, f)) for f in encoded_files
+                       if self.force or not self.log_is_current(self.vmaf_log_path(vmaf_logs_dir, f), source_path, f)]
+            for start in range(0, len(pending), VMAF_BATCH_SIZE):
+                chunk = pending[start:start + VMAF_BATCH_SIZE]
+                print(f"Running VMAF for {len(chunk)} encodes of {source_name} in one FFmpeg run...")
+                if not self.run_vmaf_batch(source_path, chunk):
+                    # Drop possibly truncated logs; the per-file runs score whatever is missing
+                    for _, log_path in chunk:
+                        log_path.unlink(missing_ok=True)
+                    print("Batched VMAF failed, falling back to one FFmpeg run per encode")
+                    break
+                fresh.update(encoded_file for encoded_file, _ in chunk)
+        
+        return [(source_path, encoded_file, vmaf_logs_dir, ref_duration, encoded_file in fresh) for encoded_file in encoded_files]
+
+    def _finish_source(self, source_name, source_path, vmaf_results):
+        """Save one source's VMAF rows to CSV and plot them"""
+        vmaf_results.sort(key=lambda row: (row["resolution"], row["qp"]))
+        
+        # Save results to CSV
+        if vmaf_results:
+            df = pd.DataFrame(vmaf_results)
+            csv_path = self.csv_dir / f"vmaf_results_{source_name}.csv"
+            df.to_csv(csv_path, index=False)
+            print(f"Results saved to {csv_path}")
             
-            # Save results to CSV
-            if vmaf_results:
-                df = pd.DataFrame(vmaf_results)
-                csv_path = self.csv_dir / f"vmaf_results_{source_name}.csv"
-                df.to_csv(csv_path, index=False)
-                print(f"Results saved to {csv_path}")
-                
-                # Generate plots
-                self.generate_plots(df, source_name, source_path)
-            else:
-                print(f"No VMAF results were successfully processed for {source_name}")
+            # Generate plots
+            self.generate_plots(df, source_name, source_path)
+        else:
+            print(f"No VMAF results were successfully processed for {source_name}")
     
+    @staticmethod
+    def _pcc_rmse(x, y):
+        """Pearson correlation and RMSE between two equal-length series"""
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        dx = x - x.mean()
+        dy = y - y.mean()
+        pcc = (dx * dy).sum() / np.sqrt((dx * dx).sum() * (dy * dy).sum())
+        diff = x - y
+        return pcc, np.sqrt(diff.dot(diff) / len(diff))
+
+    def plot_quadratic_fit(self, ax, x, y, color):
+        """Draw a least-squares quadratic fit of y over x (needs at least three points)"""
+        if len(x) < 3:
+            return
+        coeffs = np.polyfit(x, y, 2)
+        xs = np.linspace(x.min(), x.max(), 100)
+        ax.plot(xs, np.polyval(coeffs, xs), color=color, zorder=4)
+
     def generate_plots(self, df, source_name, reference_video):
         """Generate plots from VMAF results"""
         if df.empty:
@@ -246,7 +445,9 @@ class VMAFAnalyzer:
         sns.set_style("whitegrid")
         
         # --- Plot 1: VMAF Scatter: Encoded vs. Reference ---
-        plt.figure(figsize=(12, 10))
+        # Reuse one figure per plot kind across sources instead of building a new one each time
+        plt.figure(num="vmaf_scatter", figsize=(12, 10))
+        plt.clf()
         ax_scatter = plt.gca()
 
         df['vmaf_reference_for_plot'] = df['vmaf']
@@ -274,17 +475,17 @@ class VMAFAnalyzer:
 
         # Add VMAF score labels to points
         texts_scatter = []
-        for i, row in df.iterrows():
+        for vmaf in df['vmaf'].to_numpy():
             texts_scatter.append(plt.text(
-                row['vmaf'] + 0.5,
-                row['vmaf'] + 1.0,
-                f"{row['vmaf']:.1f}",
+                vmaf + 0.5,
+                vmaf + 1.0,
+                f"{vmaf:.1f}",
                 fontsize=9,
                 ha='left',
                 va='bottom'
             ))
 
-        if has_adjust_text:
+        if has_adjust_text and len(texts_scatter) <= ADJUST_TEXT_LIMIT:
             adjust_text(texts_scatter, ax=ax_scatter, arrowprops=dict(arrowstyle='-', color='gray', alpha=0.6, lw=0.5))
 
         from matplotlib.lines import Line2D
@@ -309,10 +510,10 @@ class VMAFAnalyzer:
         
         scatter_plot_path = self.plots_dir / f"vmaf_scatter_encoded_vs_reference_{source_name}.png"
         plt.savefig(scatter_plot_path, dpi=300)
-        plt.close()
         
         # --- Plot 2: VMAF vs. QP ---
-        plt.figure(figsize=(12, 8))
+        plt.figure(num="vmaf_vs_qp", figsize=(12, 8))
+        plt.clf()
         ax_qp = sns.scatterplot(
             data=df,
             x="qp",
@@ -323,34 +524,23 @@ class VMAFAnalyzer:
             zorder=5
         )
 
-        sns.regplot(
-            data=df,
-            x="qp",
-            y="vmaf",
-            scatter=False,
-            color="blue",
-            ci=None,
-            order=2,  # Quadratic fit
-            ax=ax_qp
-        )
+        self.plot_quadratic_fit(ax_qp, df["qp"], df["vmaf"], color="blue")
 
         texts_qp = []
-        for i, row in df.iterrows():
+        for qp, vmaf in zip(df['qp'].to_numpy(), df['vmaf'].to_numpy()):
             texts_qp.append(plt.text(
-                row['qp'],
-                row['vmaf'] + 1.0,
-                f"{row['vmaf']:.1f}",
+                qp,
+                vmaf + 1.0,
+                f"{vmaf:.1f}",
                 fontsize=9,
                 ha='center',
                 va='bottom'
             ))
 
-        if has_adjust_text:
+        if has_adjust_text and len(texts_qp) <= ADJUST_TEXT_LIMIT:
             adjust_text(texts_qp, ax=ax_qp, arrowprops=dict(arrowstyle='-', color='gray', alpha=0.6, lw=0.5))
 
-        pcc_qp, _ = pearsonr(df["qp"], df["vmaf"])
-        mse_vmaf_qp = mean_squared_error(df["vmaf"], df["qp"])
-        rmse_vmaf_qp = np.sqrt(mse_vmaf_qp)
+        pcc_qp, rmse_vmaf_qp = self._pcc_rmse(df["qp"], df["vmaf"])
 
         plt.title(f"VMAF vs. QP for '{os.path.basename(reference_video)}' ({self.codec.upper()}) (4K Model)\nPCC = {pcc_qp:.3f}, RMSE = {rmse_vmaf_qp:.3f}", fontsize=16)
         plt.xlabel("QP (Quantization Parameter)", fontsize=12)
@@ -365,11 +555,11 @@ class VMAFAnalyzer:
         
         qp_plot_path = self.plots_dir / f"vmaf_vs_qp_{source_name}_4k_model.png"
         plt.savefig(qp_plot_path, dpi=300)
-        plt.close()
 
         # --- Plot 3: Bitrate vs. VMAF ---
         if 'bitrate_kbps' in df.columns and not df['bitrate_kbps'].isna().all():
-            plt.figure(figsize=(12, 8))
+            plt.figure(num="bitrate_vs_vmaf", figsize=(12, 8))
+            plt.clf()
             ax_bitrate = sns.scatterplot(
                 data=df,
                 x="bitrate_kbps",
@@ -380,35 +570,25 @@ class VMAFAnalyzer:
                 zorder=5
             )
 
-            sns.regplot(
-                data=df,
-                x="bitrate_kbps",
-                y="vmaf",
-                scatter=False,
-                color="red",
-                ci=None,
-                order=2,  # Quadratic fit
-                ax=ax_bitrate
-            )
+            fit_df = df.dropna(subset=["bitrate_kbps"])
+            self.plot_quadratic_fit(ax_bitrate, fit_df["bitrate_kbps"], fit_df["vmaf"], color="red")
 
             texts_bitrate = []
-            for i, row in df.iterrows():
-                if pd.notna(row['bitrate_kbps']):  # Only label if bitrate is not NaN
+            for bitrate, vmaf in zip(df['bitrate_kbps'].to_numpy(), df['vmaf'].to_numpy()):
+                if pd.notna(bitrate):  # Only label if bitrate is not NaN
                     texts_bitrate.append(plt.text(
-                        row['bitrate_kbps'],
-                        row['vmaf'] + 1.0,
-                        f"{row['vmaf']:.1f}",
+                        bitrate,
+                        vmaf + 1.0,
+                        f"{vmaf:.1f}",
                         fontsize=9,
                         ha='center',
                         va='bottom'
                     ))
 
-            if has_adjust_text:
+            if has_adjust_text and len(texts_bitrate) <= ADJUST_TEXT_LIMIT:
                 adjust_text(texts_bitrate, ax=ax_bitrate, arrowprops=dict(arrowstyle='-', color='gray', alpha=0.6, lw=0.5))
 
-            pcc_bitrate, _ = pearsonr(df["bitrate_kbps"].dropna(), df["vmaf"].dropna())  # Drop NaN for correlation
-            mse_bitrate_vmaf = mean_squared_error(df["vmaf"].dropna(), df["bitrate_kbps"].dropna())
-            rmse_bitrate_vmaf = np.sqrt(mse_bitrate_vmaf)
+            pcc_bitrate, rmse_bitrate_vmaf = self._pcc_rmse(fit_df["bitrate_kbps"], fit_df["vmaf"])  # Rows without a bitrate are dropped
 
             plt.title(f"Bitrate vs. VMAF for '{os.path.basename(reference_video)}' ({self.codec.upper()}) (4K Model)\nPCC = {pcc_bitrate:.3f}, RMSE = {rmse_bitrate_vmaf:.3f}", fontsize=16)
             plt.xlabel("Bitrate (kbps)", fontsize=12)
@@ -420,12 +600,19 @@ class VMAFAnalyzer:
             
             bitrate_plot_path = self.plots_dir / f"bitrate_vs_vmaf_{source_name}_4k_model.png"
             plt.savefig(bitrate_plot_path, dpi=300)
-            plt.close()
         
         print(f"Plots saved to {self.plots_dir}")
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Calculate VMAF for every encoded video and plot the results")
+    parser.add_argument("--jobs", type=int, default=None, help="number of parallel VMAF runs (default: physical cores / --vmaf-threads)")
+    parser.add_argument("--vmaf-threads", type=int, default=4, help="libvmaf n_threads and ffmpeg decode threads per VMAF run")
+    parser.add_argument("--subsample", type=int, default=1, help="score every Nth frame (dev runs only; keep 1 for reportable scores)")
+    parser.add_argument("--batch", action="store_true", help=f"score up to {VMAF_BATCH_SIZE} encodes of a source in one FFmpeg run, decoding the reference once")
+    parser.add_argument("--force", action="store_true", help="recompute VMAF even for encodes whose log is newer than both videos")
+    args = parser.parse_args()
+    
     # Process each codec
     codecs = ["vvc", "av1", "h265"]
     
@@ -433,7 +620,7 @@ def main():
         print(f"\n{'='*50}")
         print(f"Processing {codec.upper()} encoded videos")
         print(f"{'='*50}")
-        analyzer = VMAFAnalyzer(codec)
+        analyzer = VMAFAnalyzer(codec, workers=args.jobs, subsample=args.subsample, vmaf_threads=args.vmaf_threads, batch=args.batch, force=args.force)
         analyzer.analyze_videos()
 
 
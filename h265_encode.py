@@ -1,7 +1,12 @@
+import argparse
 import os
 import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from video_probe import PHYSICAL_CORES, probe
+
 SOURCE_DIR = Path("video_source")
 OUTPUT_DIR = Path("h265_encoded_videos")
 
@@ -19,6 +24,18 @@ CODEC = {
     "preset": "fast"
 }
 
+# FAST_BATCH=1 trades compression efficiency for speed: no B-frames, one reference,
+# no lookahead and a fixed 60-frame keyframe interval. Leave unset for reportable quality runs.
+FAST_BATCH = os.environ.get("FAST_BATCH") == "1"
+FAST_BATCH_X265_PARAMS = "bframes=0:keyint=60:ref=1:rc-lookahead=0"
+
+# Threads given to each ffmpeg process when encodes run in parallel
+THREADS_PER_JOB = 4
+
+# Hardware HEVC encoders, in order of preference
+HW_ENCODERS = ["hevc_nvenc", "hevc_qsv", "hevc_vaapi"]
+VAAPI_DEVICE = "/dev/dri/renderD128"
+
 RESOLUTIONS = {
     "360p": "640x360",
     "720p": "1280x720",
@@ -26,39 +43,199 @@ RESOLUTIONS = {
     "2160p": "3840x2160"
 }
 
+# ffmpeg's encoder table, read once at import instead of on every check
+try:
+    _ENCODERS = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True).stdout
+    HAS_FFMPEG = True
+except Exception:
+    _ENCODERS = ""
+    HAS_FFMPEG = False
+HAS_LIBX265 = "libx265" in _ENCODERS
+
 def check_ffmpeg():
-    try:
-        result = subprocess.run(["ffmpeg", "-encoders"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if "libx265" not in result.stdout:
-            print("[✗] FFmpeg found but H.265 encoder (libx265) is not available.")
-            return False
-        return True
-    except:
+    if not HAS_FFMPEG:
         print("[✗] FFmpeg not found. Please install it.")
         return False
+    if not HAS_LIBX265:
+        print("[✗] FFmpeg found but H.265 encoder (libx265) is not available.")
+        return False
+    return True
+
+def run_ffmpeg(cmd):
+    """Runs cmd with stdout discarded and stderr spooled to a temporary file.
+    Returns (returncode, stderr); stderr is only read and decoded when the run fails."""
+    with tempfile.SpooledTemporaryFile(max_size=64 * 1024) as err:
+        returncode = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=err).returncode
+        if returncode == 0:
+            return returncode, ""
+        err.seek(0)
+        return returncode, err.read().decode("utf-8", errors="replace")
+
+def pick_hw_encoder():
+    """Returns the first hardware HEVC encoder ffmpeg offers, or None"""
+    for encoder in HW_ENCODERS:
+        if encoder in _ENCODERS:
+            return encoder
+    return None
+
+def hw_encoder_args(encoder, width, height, qp):
+    """Returns (input args, video filter, codec args) keeping decode, scale and encode on the GPU"""
+    if encoder.endswith("_nvenc"):
+        return (
+            ["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"],
+            f"scale_cuda={width}:{height}",
+            ["-c:v", encoder, "-preset", "p4", "-tune", "hq", "-rc", "constqp", "-qp", str(qp)]
+        )
+    if encoder.endswith("_qsv"):
+        return (
+            ["-hwaccel", "qsv", "-hwaccel_output_format", "qsv"],
+            f"scale_qsv=w={width}:h={height}",
+            ["-c:v", encoder, "-q", str(qp)]
+        )
+    return (
+        ["-vaapi_device", VAAPI_DEVICE],
+        f"format=nv12,hwupload,scale_vaapi=w={width}:h={height}",
+        ["-c:v", encoder, "-rc_mode", "CQP", "-qp", str(qp)]
+    )
 
 def get_exact_framerate(filepath):
     """Returns exact FPS (as float) from ffprobe"""
     try:
-        result = subprocess.run([
-            "ffprobe", "-v", "error",
-            "-select_streams", "v:0",
-            "-show_entries", "stream=r_frame_rate",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            str(filepath)
-        ], capture_output=True, text=True)
-
-        fps_raw = result.stdout.strip()
-        if "/" in fps_raw:
-            num, denom = map(int, fps_raw.split("/"))
-            return round(num / denom, 6)
-        return round(float(fps_raw), 6)
+        return probe(filepath)["fps"]
     except Exception as e:
         print(f"[!] Could not get FPS for {filepath.name}: {e}")
         return None
 
-def encode():
-    if not check_ffmpeg():
+def x265_codec_args(qp, pools):
+    x265_params = f"qp={qp}:pools={pools}"
+    if FAST_BATCH:
+        x265_params += f":{FAST_BATCH_X265_PARAMS}"
+    codec_args = [
+        "-c:v", CODEC["lib"],
+        "-x265-params", x265_params,
+        "-preset", CODEC["preset"],
+        "-pix_fmt", "yuv420p"
+    ]
+    if FAST_BATCH:
+        codec_args += ["-tune", "zerolatency"]
+    return codec_args
+
+def encode_resolution(job):
+    """Encodes every pending QP of one (source, resolution) pair in a single ffmpeg run.
+    Decode and scale happen once and fan out to one encoder per QP. Runs inside a pool worker."""
+    src, original_fps, res_name, res_value, qp_list, hw_encoder, threads = job
+
+    # Integer rates are taken from the source as-is; fractional ones (often VFR) are forced to CFR
+    rate_args = [] if float(original_fps).is_integer() else ["-vsync", "cfr", "-r", str(original_fps)]
+
+    output_args = []
+    out_names = []
+    for qp in qp_list:
+        out_name = f"{src.stem}_{CODEC['name']}_{res_name}_qp{qp}{CODEC['ext']}"
+        out_path = OUTPUT_DIR / out_name
+        if out_path.exists():
+            print(f"[Skip] {out_name} exists")
+            continue
+
+        if hw_encoder:
+            width, height = res_value.split("x")
+            input_args, video_filter, codec_args = hw_encoder_args(hw_encoder, width, height, qp)
+        else:
+            input_args = []
+            video_filter = f"scale={res_value}"
+            codec_args = x265_codec_args(qp, threads)
+
+        output_args += [
+            "-map", "0:v",
+            "-vf", video_filter,
+            *rate_args,
+            *codec_args,
+            str(out_path)
+        ]
+        out_names.append(out_name)
+
+    if not out_names:
+        return []
+
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error", "-nostats",
+        "-threads", str(threads),
+        *input_args,
+        "-i", str(src),
+        *output_args
+    ]
+
+    print(f"[Encoding] {', '.join(out_names)}")
+    returncode, stderr = run_ffmpeg(cmd)
+
+    if returncode == 0:
+        return [(out_name, "done", None) for out_name in out_names]
+
+    # A failed run leaves every output of the command incomplete
+    for out_name in out_names:
+        (OUTPUT_DIR / out_name).unlink(missing_ok=True)
+    error_lines = stderr.splitlines()[-10:]
+    return [(out_name, "error", error_lines) for out_name in out_names]
+
+def encode_source(job):
+    """Encodes every pending (resolution, QP) of one source in a single ffmpeg run.
+    The source is decoded once and split into one scaler per resolution, each feeding its QP encoders."""
+    src, original_fps, pending, threads = job
+
+    # pending maps resolution -> QPs still to encode
+    resolutions = [res_name for res_name in RESOLUTIONS if pending.get(res_name)]
+    # x265 pool size per encoder, so all encoders of the graph together stay within the job's share
+    pools = max(1, threads // sum(len(pending[res_name]) for res_name in resolutions))
+    rate_args = [] if float(original_fps).is_integer() else ["-vsync", "cfr", "-r", str(original_fps)]
+
+    graph = [f"[0:v]split={len(resolutions)}" + "".join(f"[s{res_name}]" for res_name in resolutions)]
+    for res_name in resolutions:
+        # A filter output feeds one encoder only, so each scaled stream is split again per QP
+        labels = "".join(f"[v{res_name}_{qp}]" for qp in pending[res_name])
+        graph.append(f"[s{res_name}]scale={RESOLUTIONS[res_name]},split={len(pending[res_name])}{labels}")
+
+    output_args = []
+    out_names = []
+    for res_name in resolutions:
+        for qp in pending[res_name]:
+            out_name = f"{src.stem}_{CODEC['name']}_{res_name}_qp{qp}{CODEC['ext']}"
+            output_args += [
+                "-map", f"[v{res_name}_{qp}]",
+                *rate_args,
+                *x265_codec_args(qp, pools),
+                str(OUTPUT_DIR / out_name)
+            ]
+            out_names.append(out_name)
+
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error", "-nostats",
+        "-threads", str(threads),
+        "-i", str(src),
+        "-filter_complex", ";".join(graph),
+        *output_args
+    ]
+
+    print(f"[Encoding] {src.name} → {len(out_names)} output(s)")
+    returncode, stderr = run_ffmpeg(cmd)
+
+    if returncode == 0:
+        return [(out_name, "done", None) for out_name in out_names]
+
+    # A failed run leaves every output of the command incomplete
+    for out_name in out_names:
+        (OUTPUT_DIR / out_name).unlink(missing_ok=True)
+    error_lines = stderr.splitlines()[-10:]
+    return [(out_name, "error", error_lines) for out_name in out_names]
+
+def encode(use_hw=False, workers=None):
+    hw_encoder = pick_hw_encoder() if use_hw else None
+    if use_hw:
+        if hw_encoder:
+            print(f"[i] Using hardware encoder {hw_encoder}")
+        else:
+            print(f"[!] No hardware HEVC encoder found, falling back to {CODEC['lib']}.")
+
+    if hw_encoder is None and not check_ffmpeg():
         return
 
     SOURCE_DIR.mkdir(parents=True, exist_ok=True)
@@ -73,47 +250,61 @@ def encode():
 
     print(f"[i] Found {len(source_files)} video files")
 
+    # One directory listing instead of a stat() per prospective output
+    existing = {entry.name for entry in os.scandir(OUTPUT_DIR) if entry.is_file()}
+
+    jobs = []
     for src in source_files:
         print(f"\n[i] Processing {src.name}")
 
+        pending = {
+            res_name: [qp for qp in CODEC["qp_values"][res_name]
+                       if f"{src.stem}_{CODEC['name']}_{res_name}_qp{qp}{CODEC['ext']}" not in existing]
+            for res_name in RESOLUTIONS
+        }
+        if not any(pending.values()):
+            print(f"[Skip] All encodes for {src.name} exist")
+            continue
+
         original_fps = get_exact_framerate(src)
         if original_fps is None:
             print("[!] Skipping due to FPS read error.")
             continue
 
+        if hw_encoder is None:
+            # Software path: one split graph decodes the source once for every resolution
+            jobs.append((src, original_fps, pending))
+            continue
+
         for res_name, res_value in RESOLUTIONS.items():
-            for qp in CODEC["qp_values"][res_name]:
-                out_name = f"{src.stem}_{CODEC['name']}_{res_name}_qp{qp}{CODEC['ext']}"
-                out_path = OUTPUT_DIR / out_name
-
-                if out_path.exists():
-                    print(f"[Skip] {out_name} exists")
-                    continue
-
-                cmd = [
-                    "ffmpeg", "-y",
-                    "-r", str(original_fps),      # Input FPS (important for VFR sources)
-                    "-i", str(src),
-                    "-vf", f"scale={res_value}",
-                    "-r", str(original_fps),      # Output FPS
-                    "-c:v", CODEC["lib"],
-                    "-x265-params", f"qp={qp}",
-                    "-preset", CODEC["preset"],
-                    "-pix_fmt", "yuv420p",
-                    "-shortest",                  # Ensures no duration overshoot
-                    str(out_path)
-                ]
-
-                print(f"[Encoding] {out_name}")
-                result = subprocess.run(cmd, stderr=subprocess.PIPE, text=True)
-
-                if result.returncode == 0:
+            if pending[res_name]:
+                jobs.append((src, original_fps, res_name, res_value, pending[res_name], hw_encoder))
+
+    if not jobs:
+        return
+
+    cpu_count = PHYSICAL_CORES
+    workers = max(1, min(workers or cpu_count // THREADS_PER_JOB, len(jobs)))
+    threads = max(1, cpu_count // workers)
+    jobs = [job + (threads,) for job in jobs]
+    print(f"\n[i] Running {len(jobs)} encode(s) on {workers} worker(s), {threads} thread(s) each")
+
+    # Each worker only waits on its ffmpeg process, so threads are enough
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for results in executor.map(encode_source if hw_encoder is None else encode_resolution, jobs):
+            for out_name, status, error_lines in results:
+                if status == "done":
+                    existing.add(out_name)
                     print(f"[✓] Done: {out_name}")
                 else:
-                    print(f"[✗] Error in {out_name}:\n{result.stderr.splitlines()[-10:]}")
+                    print(f"[✗] Error in {out_name}:\n{error_lines}")
 
     print("\n[✓] H.265 encoding complete.")
     print(f"[i] Encoded videos saved in '{OUTPUT_DIR}'")
 
 if __name__ == "__main__":
-    encode()
+    parser = argparse.ArgumentParser(description="Encode source videos with H.265/HEVC")
+    parser.add_argument("--hw", action="store_true", help="use a hardware HEVC encoder (NVENC/QSV/VAAPI) if available")
+    parser.add_argument("--jobs", type=int, default=None, help="number of parallel encodes (default: CPU cores / THREADS_PER_JOB)")
+    args = parser.parse_args()
+    encode(use_hw=args.hw, workers=args.jobs)
\ No newline at end of file
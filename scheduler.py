@@ -0,0 +1,207 @@
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import av1_encode
+import h265_encode
+import vvc_encode
+from video_probe import PHYSICAL_CORES, probe
+
+SOURCE_DIR = Path("video_source")
+VIDEO_EXTENSIONS = ['.mp4', '.mkv', '.avi', '.mov', '.webm']
+
+# Threads given to each software encode when sizing the CPU pool
+THREADS_PER_JOB = 4
+
+# Concurrent NVENC sessions; consumer GeForce cards allow 3-8 depending on driver
+DEFAULT_GPU_SLOTS = 3
+
+# Concurrent ffprobe calls when reading the sources before scheduling
+PROBE_WORKERS = 8
+
+# Pixel height per resolution name, used to order the queues
+RESOLUTION_HEIGHTS = {"360p": 360, "720p": 720, "1080p": 1080, "2160p": 2160}
+
+@dataclass
+class Job:
+    src: Path
+    codec: str      # av1, h265 or vvc
+    res: str        # e.g. "1080p"
+    qp_list: list   # every QP of a resolution is encoded from one decode/scale pass
+    device: str     # cpu or gpu
+    info: dict      # probe() result of src: fps, duration, width, height
+
+    @property
+    def name(self):
+        return f"{self.src.stem}_{self.codec}_{self.res}"
+
+@dataclass
+class VvcState:
+    """vvc_encode's bookkeeping, shared by the VVC jobs of one run"""
+    encoder_id: str
+    manifest: dict
+    signatures: dict   # output name -> signature recorded once it is encoded
+    pending: dict      # source -> {resolution: [qp]} not yet encoded with the current settings
+    reserved: int = 0  # RAM reserved by the 2160p jobs running now
+
+def build_jobs(source_infos, codecs, hw_encoders, vvc_state):
+    """Enumerates the (source, codec, resolution) matrix of every encoder script"""
+    jobs = []
+    for src, info in source_infos.items():
+        for codec in codecs:
+            device = "gpu" if hw_encoders.get(codec) else "cpu"
+            if codec == "av1":
+                # AV1 encodes are cut to the probed duration, like av1_encode.main
+                if not info["duration"]:
+                    print(f"[!] Skipping AV1 jobs of {src.name}: no duration")
+                    continue
+                for res_name in av1_encode.RESOLUTIONS:
+                    jobs.append(Job(src, codec, res_name, av1_encode.QP_VALUES[res_name], device, info))
+            elif codec == "h265":
+                for res_name in h265_encode.RESOLUTIONS:
+                    jobs.append(Job(src, codec, res_name, h265_encode.CODEC["qp_values"][res_name], device, info))
+            elif codec == "vvc":
+                for resolution, qp_list in vvc_state.pending[src].items():
+                    if qp_list:
+                        jobs.append(Job(src, codec, f"{resolution}p", qp_list, "cpu", info))
+    return jobs
+
+def order_jobs(jobs):
+    """Both queues run largest-first (pixels per frame x encodes sharing the decode), so 4K lands
+    early on NVENC and on the CPU pool instead of trailing at the end, as in vvc_encode.main."""
+    def cost(job):
+        return RESOLUTION_HEIGHTS[job.res] ** 2 * len(job.qp_list)
+    gpu_jobs = sorted((j for j in jobs if j.device == "gpu"), key=cost, reverse=True)
+    cpu_jobs = sorted((j for j in jobs if j.device == "cpu"), key=cost, reverse=True)
+    ordered = []
+    for i in range(max(len(gpu_jobs), len(cpu_jobs))):
+        if i < len(gpu_jobs):
+            ordered.append(gpu_jobs[i])
+        if i < len(cpu_jobs):
+            ordered.append(cpu_jobs[i])
+    return ordered
+
+def job_call(job, hw_encoders, threads):
+    """Returns (function, argument) running the job with its script's own worker function"""
+    fps, duration = job.info["fps"], job.info["duration"]
+
+    if job.codec == "av1":
+        width, height = av1_encode.RESOLUTIONS[job.res].split("x")
+        return av1_encode.encode_tier, (job.src, job.src, fps, duration, job.res, width, height,
+                                        job.qp_list, hw_encoders.get("av1"), threads)
+    if job.codec == "h265":
+        return h265_encode.encode_resolution, (job.src, fps, job.res, h265_encode.RESOLUTIONS[job.res],
+                                               job.qp_list, hw_encoders.get("h265"), threads)
+    return vvc_encode.encode_job, (job.src, RESOLUTION_HEIGHTS[job.res], job.qp_list, round(fps),
+                                   threads, vvc_encode.DEFAULT_PRESET)
+
+async def run_job(job, hw_encoders, threads, cpu_pool, gpu_slots, vvc_state):
+    loop = asyncio.get_running_loop()
+    func, arg = job_call(job, hw_encoders, threads)
+    start = time.perf_counter()
+
+    if job.device == "gpu":
+        # ffmpeg does the work, so a thread is enough; the semaphore caps NVENC sessions
+        async with gpu_slots:
+            results = await loop.run_in_executor(None, func, arg)
+    elif job.codec == "vvc":
+        # 2160p VVC jobs are held back here, before they take a pool worker, until memory allows
+        need = vvc_encode.job_memory(RESOLUTION_HEIGHTS[job.res], len(job.qp_list))
+        while not vvc_encode.fits_in_memory(need, vvc_state.reserved):
+            await asyncio.sleep(vvc_encode.MEMORY_POLL_SEC)
+        vvc_state.reserved += need
+        try:
+            results = await loop.run_in_executor(cpu_pool, func, arg)
+        finally:
+            vvc_state.reserved -= need
+    else:
+        results = await loop.run_in_executor(cpu_pool, func, arg)
+
+    for output_name, status, error_msg in results or []:
+        if status == "error":
+            print(f"[✗] Error encoding {output_name}:\n{error_msg}\n")
+        elif job.codec == "vvc":
+            vvc_state.manifest[output_name] = vvc_state.signatures[output_name]
+    if job.codec == "vvc":
+        vvc_encode.save_manifest(vvc_state.manifest)
+    print(f"[✓] {job.name} on {job.device} took {time.perf_counter() - start:.1f}s")
+
+async def run_all(jobs, hw_encoders, cpu_workers, gpu_slots, vvc_state):
+    threads = max(1, PHYSICAL_CORES // cpu_workers)
+    semaphore = asyncio.Semaphore(gpu_slots)
+    with ProcessPoolExecutor(max_workers=cpu_workers) as cpu_pool:
+        await asyncio.gather(*(run_job(job, hw_encoders, threads, cpu_pool, semaphore, vvc_state) for job in jobs))
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the AV1, H.265 and VVC encode matrix through one scheduler")
+    parser.add_argument("--codecs", nargs="+", default=["av1", "h265", "vvc"], choices=["av1", "h265", "vvc"])
+    parser.add_argument("--hw", action="store_true", help="send AV1/H.265 jobs to a hardware encoder if available")
+    parser.add_argument("--cpu-workers", type=int, default=None, help="parallel software encodes (default: CPU cores / THREADS_PER_JOB)")
+    parser.add_argument("--gpu-slots", type=int, default=DEFAULT_GPU_SLOTS, help="concurrent hardware encode sessions")
+    args = parser.parse_args()
+
+    source_files = [f for f in SOURCE_DIR.glob("*") if f.is_file() and f.suffix.lower() in VIDEO_EXTENSIONS]
+    if not source_files:
+        print("[!] No source videos found.")
+        return
+
+    def probe_source(src):
+        try:
+            return probe(src), None
+        except Exception as e:
+            return None, e
+
+    # Every source is probed once up front, concurrently, instead of per job inside the event loop
+    source_infos = {}
+    with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as executor:
+        for src, (info, error) in zip(source_files, executor.map(probe_source, source_files)):
+            if error is not None:
+                print(f"[!] Skipping {src.name}: could not probe it: {error}")
+                continue
+            source_infos[src] = info
+    if not source_infos:
+        return
+
+    hw_encoders = {}
+    if args.hw:
+        hw_encoders = {
+            "av1": av1_encode.pick_hw_encoder() if "av1" in args.codecs else None,
+            "h265": h265_encode.pick_hw_encoder() if "h265" in args.codecs else None
+        }
+        for codec, encoder in hw_encoders.items():
+            if encoder:
+                print(f"[i] {codec.upper()} jobs use {encoder}")
+
+    vvc_state = None
+    if "vvc" in args.codecs:
+        # Same version gate and manifest as vvc_encode.main, so both skip and redo the same outputs
+        vvenc_version = vvc_encode.check_vvencapp()
+        if vvenc_version is None:
+            print("[!] Skipping VVC jobs: vvencapp is not available")
+            args.codecs.remove("vvc")
+        else:
+            vvc_state = VvcState(f"vvencapp {vvenc_version}", vvc_encode.load_manifest(), {}, {})
+            existing = {entry.name for entry in os.scandir(vvc_encode.OUTPUT_DIR) if entry.is_file()}
+            for src in source_infos:
+                vvc_state.pending[src] = vvc_encode.pending_encodes(src, vvc_encode.DEFAULT_PRESET, vvc_state.encoder_id,
+                                                                    vvc_state.manifest, existing, vvc_state.signatures)
+
+    av1_encode.OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    h265_encode.OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    jobs = order_jobs(build_jobs(source_infos, args.codecs, hw_encoders, vvc_state))
+    cpu_workers = args.cpu_workers or max(1, PHYSICAL_CORES // THREADS_PER_JOB)
+    gpu_count = sum(1 for job in jobs if job.device == "gpu")
+    print(f"[i] {len(jobs)} jobs: {gpu_count} on GPU ({args.gpu_slots} slots), "
+          f"{len(jobs) - gpu_count} on CPU ({cpu_workers} workers)")
+
+    start = time.perf_counter()
+    asyncio.run(run_all(jobs, hw_encoders, cpu_workers, args.gpu_slots, vvc_state))
+    print(f"\n[✓] All jobs finished in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
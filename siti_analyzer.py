@@ -1,34 +1,20 @@
+import argparse
 import cv2
 import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")  # Plots are only saved to files; no GUI backend needed
 import matplotlib.pyplot as plt
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
-print("Video Content Analyzer Starting...")
+import siti_core
+from video_probe import PHYSICAL_CORES
 
-# Make results folder if it doesn't exist
-if not os.path.exists('siti_results'):
-    os.makedirs('siti_results')
-    print("results folder created.")
 
-# Find MP4 and MKV files
-video_list = []
-for file in os.listdir('video_source'):
-    if file.endswith('.mp4') or file.endswith('.mkv'):
-        video_list.append(file)
-
-if len(video_list) == 0:
-    print("No MP4 or MKV files found in videos folder!")
-    exit()
-
-print("Found these videos:")
-for video in video_list:
-    print("- " + video)
-
-# Lists to store data from all videos
-all_video_data = []
-
-# Look at each video
-for video_name in video_list:
+def analyze_video(video_name, hwdec=False, opencl=False, approx=False):
+    """Computes per-frame SI/TI for one video and writes its CSV. Runs inside a worker process."""
     print("\nAnalysing: " + video_name)
     
     # Open video
@@ -37,65 +23,28 @@ for video_name in video_list:
     
     if not cap.isOpened():
         print("Cannot open " + video_name)
-        continue
+        return None
     
     # Get video info
     frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
     
     print("Frames: " + str(frame_count))
     print("FPS: " + str(fps))
     
-    # Lists to save numbers
-    si_list = []  # complexity numbers
-    ti_list = []  # movement numbers
-    
-    # Read first frame
-    ret, old_frame = cap.read()
-    if not ret:
+    si, ti = siti_core.analyze(video_path, hwdec, opencl, approx)
+    if si.size == 0:
         print("Cannot read video.")
-        cap.release()
-        continue
-    
-    frame_num = 1
-    
-    # Go through all frames
-    while True:
-        ret, new_frame = cap.read()
-        if not ret:
-            break
-        
-        frame_num = frame_num + 1
-        
-        # Make frames gray
-        old_gray = cv2.cvtColor(old_frame, cv2.COLOR_BGR2GRAY)
-        new_gray = cv2.cvtColor(new_frame, cv2.COLOR_BGR2GRAY)
-        
-        # Find edges (complexity)
-        edges_x = cv2.Sobel(new_gray, cv2.CV_64F, 1, 0)
-        edges_y = cv2.Sobel(new_gray, cv2.CV_64F, 0, 1)
-        edges = np.sqrt(edges_x * edges_x + edges_y * edges_y)
-        si = np.std(edges)
-        si_list.append(si)
-        
-        # Find difference (movement)
-        diff = cv2.absdiff(old_gray, new_gray)
-        ti = np.std(diff.astype(float))
-        ti_list.append(ti)
-        
-        # Show progress
-        if frame_num % 100 == 0:
-            print("Processed " + str(frame_num) + " frames.")
-        
-        old_frame = new_frame
-    
-    cap.release()
+        return None
+    si_list = si.tolist()  # complexity numbers
+    ti_list = ti.tolist()  # movement numbers
     
     # Calculate averages
-    avg_si = sum(si_list) / len(si_list)
-    avg_ti = sum(ti_list) / len(ti_list)
-    max_si = max(si_list)
-    max_ti = max(ti_list)
+    avg_si = float(si.mean())
+    avg_ti = float(ti.mean())
+    max_si = float(si.max())
+    max_ti = float(ti.max())
     
     print("Average complexity: " + str(round(avg_si, 1)))
     print("Average movement: " + str(round(avg_ti, 1)))
@@ -109,82 +58,122 @@ for video_name in video_list:
     video_data['avg_ti'] = avg_ti
     video_data['max_si'] = max_si
     video_data['max_ti'] = max_ti
-    all_video_data.append(video_data)
     
     # Save individual data to CSV
     csv_name = video_name.replace('.mp4', '_siti.csv').replace('.mkv', '_siti.csv')
-    with open('siti_results/' + csv_name, 'w') as f:
-        f.write('input_file,si,ti,n\n')  # Header
-        for i in range(len(si_list)):
-            frame_num = i + 1
-            si_value = round(si_list[i], 3)
-            ti_value = round(ti_list[i], 3)
-            f.write(video_name + ',' + str(si_value) + ',' + str(ti_value) + ',' + str(frame_num) + '\n')
+    pd.DataFrame({
+        'input_file': video_name,
+        'si': np.round(si_list, 3),
+        'ti': np.round(ti_list, 3),
+        'n': np.arange(1, len(si_list) + 1)
+    }).to_csv('siti_results/' + csv_name, index=False)
     
     print("Saved data: " + csv_name)
+    
+    return video_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute SI/TI for every source video")
+    parser.add_argument("--hwdec", action="store_true", help="decode on the GPU with ffmpeg's CUDA hwaccel (NVDEC)")
+    parser.add_argument("--opencl", action="store_true", help="compute SI/TI on an OpenCL GPU through OpenCV's UMat")
+    parser.add_argument("--approx-si", action="store_true", help="integer |dx| + |dy| gradient for SI (faster; reads up to ~41%% high, not for reportable SI)")
+    args = parser.parse_args()
+
+    print("Video Content Analyzer Starting...")
+
+    # Make results folder if it doesn't exist
+    if not os.path.exists('siti_results'):
+        os.makedirs('siti_results')
+        print("results folder created.")
+
+    # Find MP4 and MKV files
+    video_list = []
+    for file in os.listdir('video_source'):
+        if file.endswith('.mp4') or file.endswith('.mkv'):
+            video_list.append(file)
+
+    if len(video_list) == 0:
+        print("No MP4 or MKV files found in videos folder!")
+        return
+
+    print("Found these videos:")
+    for video in video_list:
+        print("- " + video)
+
+    # Analyse videos in parallel; each worker decodes and scores one video.
+    # Numba and OpenCV would otherwise start a thread per core in every worker
+    workers = max(1, min(PHYSICAL_CORES // siti_core.THREADS_PER_VIDEO, len(video_list)))
+    threads = max(1, PHYSICAL_CORES // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=siti_core.limit_threads, initargs=(threads,)) as executor:
+        all_video_data = [video_data for video_data in executor.map(analyze_video, video_list, repeat(args.hwdec), repeat(args.opencl), repeat(args.approx_si)) if video_data]
+
+    # Creating SITI graph
+    print("\nCreating SITI graph...")
+    plt.figure(figsize=(12, 8))
+    colors = ['blue', 'red', 'green', 'orange', 'purple', 'brown', 'pink', 'gray', 'cyan', 'magenta']
+    color_index = 0
 
-# Creating SITI graph
-print("\nCreating SITI graph...")
-plt.figure(figsize=(12, 8))
-colors = ['blue', 'red', 'green', 'orange', 'purple', 'brown', 'pink', 'gray', 'cyan', 'magenta']
-color_index = 0
-
-for video_data in all_video_data:
-    color = colors[color_index % len(colors)]
-    plt.scatter(video_data['si_list'], video_data['ti_list'], 
-               alpha=0.6, label=video_data['name'], c=color)
-    color_index = color_index + 1
-
-plt.xlabel('SI (Spatial Information)')
-plt.ylabel('TI (Temporal Information)')
-plt.title('SITI Analysis - All Frames')
-plt.grid(True)
-plt.legend()
-
-# Save SITI graph
-plt.savefig('siti_results/siti_all_frames.png')
-plt.close()
-
-# Create new plot for average SI-TI values
-print("\nCreating average SITI plot...")
-plt.figure(figsize=(10, 8))
-
-# Extract average values
-avg_si_values = [video_data['avg_si'] for video_data in all_video_data]
-avg_ti_values = [video_data['avg_ti'] for video_data in all_video_data]
-video_names = [video_data['name'] for video_data in all_video_data]
-
-# Create scatter plot with average values
-colors = ['blue', 'red', 'green', 'orange', 'purple', 'brown', 'pink', 'gray', 'cyan', 'magenta']
-for i, (si, ti, name) in enumerate(zip(avg_si_values, avg_ti_values, video_names)):
-    color = colors[i % len(colors)]
-    plt.scatter(si, ti, s=200, c=color, alpha=0.7, edgecolors='black', linewidth=2)
-    plt.annotate(name.replace('.mp4', '').replace('.mkv', ''), 
-                (si, ti), xytext=(5, 5), textcoords='offset points', 
-                fontsize=10, ha='left')
-
-plt.xlabel('SI (Spatial Information) - Average')
-plt.ylabel('TI (Temporal Information) - Average')
-plt.title('SITI Analysis - Average Values per Source Video')
-plt.grid(True, alpha=0.3)
-
-# Save average SITI plot
-plt.savefig('siti_results/siti_average_values.png', dpi=300, bbox_inches='tight')
-plt.close()
-
-# Create summary CSV with mean SI and TI values
-print("\nCreating summary CSV with mean values...")
-with open('siti_results/siti_summary.csv', 'w') as f:
-    f.write('input_file,si,ti\n')  # Header
     for video_data in all_video_data:
-        video_name = video_data['name']
-        avg_si = round(video_data['avg_si'], 3)
-        avg_ti = round(video_data['avg_ti'], 3)
-        f.write(video_name + ',' + str(avg_si) + ',' + str(avg_ti) + '\n')
-
-print("Saved SITI summary: siti_summary.csv")
-
-print("Saved SITI plots")
-print("\nAll done! Check the siti_results folder.")
-# End of script
-print("Video Content Analyzer Finished.")
\ No newline at end of file
+        color = colors[color_index % len(colors)]
+        plt.scatter(video_data['si_list'], video_data['ti_list'], 
+                   alpha=0.6, label=video_data['name'], c=color)
+        color_index = color_index + 1
+
+    plt.xlabel('SI (Spatial Information)')
+    plt.ylabel('TI (Temporal Information)')
+    plt.title('SITI Analysis - All Frames')
+    plt.grid(True)
+    plt.legend()
+
+    # Save SITI graph
+    plt.savefig('siti_results/siti_all_frames.png')
+    plt.close()
+
+    # Create new plot for average SI-TI values
+    print("\nCreating average SITI plot...")
+    plt.figure(figsize=(10, 8))
+
+    # Extract average values
+    avg_si_values = [video_data['avg_si'] for video_data in all_video_data]
+    avg_ti_values = [video_data['avg_ti'] for video_data in all_video_data]
+    video_names = [video_data['name'] for video_data in all_video_data]
+
+    # Create scatter plot with average values
+    colors = ['blue', 'red', 'green', 'orange', 'purple', 'brown', 'pink', 'gray', 'cyan', 'magenta']
+    for i, (si, ti, name) in enumerate(zip(avg_si_values, avg_ti_values, video_names)):
+        color = colors[i % len(colors)]
+        plt.scatter(si, ti, s=200, c=color, alpha=0.7, edgecolors='black', linewidth=2)
+        plt.annotate(name.replace('.mp4', '').replace('.mkv', ''), 
+                    (si, ti), xytext=(5, 5), textcoords='offset points', 
+                    fontsize=10, ha='left')
+
+    plt.xlabel('SI (Spatial Information) - Average')
+    plt.ylabel('TI (Temporal Information) - Average')
+    plt.title('SITI Analysis - Average Values per Source Video')
+    plt.grid(True, alpha=0.3)
+
+    # Save average SITI plot
+    plt.savefig('siti_results/siti_average_values.png', dpi=300, bbox_inches='tight')
+    plt.close()
+
+    # Create summary CSV with mean SI and TI values
+    print("\nCreating summary CSV with mean values...")
+    with open('siti_results/siti_summary.csv', 'w') as f:
+        f.write('input_file,si,ti\n')  # Header
+        for video_data in all_video_data:
+            video_name = video_data['name']
+            avg_si = round(video_data['avg_si'], 3)
+            avg_ti = round(video_data['avg_ti'], 3)
+            f.write(video_name + ',' + str(avg_si) + ',' + str(avg_ti) + '\n')
+
+    print("Saved SITI summary: siti_summary.csv")
+
+    print("Saved SITI plots")
+    print("\nAll done! Check the siti_results folder.")
+    # End of script
+    print("Video Content Analyzer Finished.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import functools
+import hashlib
+import os
+import subprocess
+import tempfile
+import zipfile
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# Per-frame SI/TI arrays are persisted here so reruns (e.g. while tweaking plots) skip decoding
+CACHE_DIR = Path(".siti_cache")
+# Bump when the computation changes so stale entries are ignored
+CACHE_VERSION = 2
+
+# PyAV decodes straight to luma, skipping OpenCV's BGR decode and the gray conversion
+try:
+    import av
+    has_pyav = True
+except ImportError:
+    has_pyav = False
+
+# 8-bit decoder formats whose first plane already is the luma image
+LUMA_PLANE_FORMATS = {"yuv420p", "yuvj420p", "yuv422p", "yuvj422p", "yuv444p", "yuvj444p", "nv12", "gray"}
+
+# Of those, the formats that always carry full-range luma; the others follow frame.color_range
+FULL_RANGE_FORMATS = {"yuvj420p", "yuvj422p", "yuvj444p", "gray"}
+
+# AVCOL_RANGE_JPEG, FFmpeg's color_range value for full-range frames
+COLOR_RANGE_FULL = 2
+
+# Expands limited-range luma (16-235) to full range, matching OpenCV's BGR decode + BGR2GRAY
+LIMITED_TO_FULL_LUT = np.clip(np.round((np.arange(256) - 16) * 255 / 219), 0, 255).astype(np.uint8)
+
+# Relative tolerance for the OpenCL results against the CPU path, checked on the first frame pair
+OPENCL_RTOL = 1e-3
+
+# Numba fuses the Sobel, magnitude, difference and std passes into one loop over the pixels
+try:
+    from numba import njit, prange, set_num_threads
+    has_numba = True
+except ImportError:
+    has_numba = False
+
+
+# Threads given to each video's SI/TI kernels when several videos are analysed in parallel
+THREADS_PER_VIDEO = 4
+
+
+def limit_threads(threads):
+    """Caps this process's Numba and OpenCV thread pools; the initializer of parallel analysis workers"""
+    if has_numba:
+        set_num_threads(threads)
+    cv2.setNumThreads(threads)
+
+
+def read_gray_frames(video_path, width=None, height=None, hwdec=False):
+    """Yields every frame of the video as an 8-bit grayscale array.
+    Every decode path yields full-range (0-255) luma, the scale of OpenCV's BGR decode + BGR2GRAY,
+    so SI/TI values do not depend on which decoder is installed.
+    With hwdec, ffmpeg decodes on the GPU (NVDEC) and pipes raw luma frames of width x height."""
+    if hwdec:
+        cmd = [
+            "ffmpeg", "-loglevel", "error", "-nostats",
+            "-hwaccel", "cuda",
+            "-i", video_path,
+            "-vf", "scale=out_range=full,format=gray",  # Expand limited-range (16-235) luma to 0-255
+            "-f", "rawvideo", "-pix_fmt", "gray", "-"
+        ]
+        frame_size = width * height
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                buffer = process.stdout.read(frame_size)
+                if len(buffer) < frame_size:
+                    break
+                yield np.frombuffer(buffer, np.uint8).reshape(height, width)
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+    elif has_pyav:
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"
+            for frame in container.decode(stream):
+                if frame.format.name in LUMA_PLANE_FORMATS:
+                    # View the Y plane in place (rows padded to line_size) instead of running swscale
+                    plane = frame.planes[0]
+                    luma = np.frombuffer(plane, np.uint8).reshape(-1, plane.line_size)[:frame.height, :frame.width]
+                    if frame.format.name in FULL_RANGE_FORMATS or getattr(frame, "color_range", 0) == COLOR_RANGE_FULL:
+                        yield luma
+                    else:
+                        # Unspecified range is treated as limited, as swscale and OpenCV do
+                        yield cv2.LUT(luma, LIMITED_TO_FULL_LUT)
+                else:
+                    # Through BGR like the OpenCV path, which expands limited-range video to 0-255
+                    yield cv2.cvtColor(frame.to_ndarray(format='bgr24'), cv2.COLOR_BGR2GRAY)
+    else:
+        cap = cv2.VideoCapture(video_path)
+        try:
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                yield cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        finally:
+            cap.release()
+
+
+if has_numba:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def si_ti_kernel(prev, cur):
+        """Returns (SI, TI) of cur: std of the 3x3 Sobel magnitude and of |cur - prev|.
+        Borders are reflected like OpenCV's default, so results match the cv2 path."""
+        h, w = cur.shape
+        si_sum = np.zeros(h)
+        si_sq = np.zeros(h)
+        ti_sum = np.zeros(h)
+        ti_sq = np.zeros(h)
+        for y in prange(h):
+            ym = y - 1 if y > 0 else 1
+            yp = y + 1 if y < h - 1 else h - 2
+            row_si_sum = 0.0
+            row_si_sq = 0.0
+            row_ti_sum = 0.0
+            row_ti_sq = 0.0
+            for x in range(w):
+                xm = x - 1 if x > 0 else 1
+                xp = x + 1 if x < w - 1 else w - 2
+                gx = (float(cur[ym, xp]) + 2.0 * cur[y, xp] + cur[yp, xp]) - (float(cur[ym, xm]) + 2.0 * cur[y, xm] + cur[yp, xm])
+                gy = (float(cur[yp, xm]) + 2.0 * cur[yp, x] + cur[yp, xp]) - (float(cur[ym, xm]) + 2.0 * cur[ym, x] + cur[ym, xp])
+                mag = np.sqrt(gx * gx + gy * gy)
+                row_si_sum += mag
+                row_si_sq += mag * mag
+                d = abs(float(cur[y, x]) - float(prev[y, x]))
+                row_ti_sum += d
+                row_ti_sq += d * d
+            si_sum[y] = row_si_sum
+            si_sq[y] = row_si_sq
+            ti_sum[y] = row_ti_sum
+            ti_sq[y] = row_ti_sq
+
+        n = h * w
+        si_mean = si_sum.sum() / n
+        ti_mean = ti_sum.sum() / n
+        si = np.sqrt(max(si_sq.sum() / n - si_mean * si_mean, 0.0))
+        ti = np.sqrt(max(ti_sq.sum() / n - ti_mean * ti_mean, 0.0))
+        return si, ti
+
+
+def compute_siti(video_path, width, height, hwdec=False, frame_count=0, opencl=False, approx=False):
+    """Returns per-frame (SI, TI) arrays; the first frame only serves as TI reference.
+    frame_count is a sizing hint for the result arrays; they grow if the container under-reports.
+    With opencl, the Sobel/magnitude/difference/std math runs on an OpenCL device through cv2.UMat.
+    With approx, SI uses the integer |dx| + |dy| gradient, which reads up to ~41% above the exact magnitude."""
+    if opencl and not cv2.ocl.haveOpenCL():
+        print("OpenCL not available, computing SI/TI on the CPU.")
+        opencl = False
+    if opencl:
+        cv2.ocl.setUseOpenCL(True)
+
+    # Arrays to save numbers, filled in place instead of appending Python floats
+    capacity = max(frame_count, 1)
+    si_values = np.empty(capacity)  # complexity numbers
+    ti_values = np.empty(capacity)  # movement numbers
+    count = 0
+    
+    # Read first frame
+    frames = read_gray_frames(video_path, width, height, hwdec)
+    old_gray = next(frames, None)
+    if old_gray is None:
+        return np.empty(0), np.empty(0)
+    
+    frame_num = 1
+    
+    # Reusable buffers for the OpenCV path, so 4K frames don't allocate fresh arrays every frame
+    edges_x = np.empty(old_gray.shape, np.float32)
+    edges_y = np.empty_like(edges_x)
+    edges = np.empty_like(edges_x)
+    diff = np.empty_like(old_gray)
+    old_umat = cv2.UMat(old_gray) if opencl else None
+    grad_x16 = np.empty(old_gray.shape, np.int16)
+    grad_y16 = np.empty_like(grad_x16)
+
+    def cpu_siti(prev, cur):
+        # Find edges (complexity)
+        # float32 and OpenCV's own magnitude/std keep this in SIMD code without float64 copies
+        cv2.Sobel(cur, cv2.CV_32F, 1, 0, dst=edges_x)
+        cv2.Sobel(cur, cv2.CV_32F, 0, 1, dst=edges_y)
+        cv2.magnitude(edges_x, edges_y, edges)
+        si = cv2.meanStdDev(edges)[1][0, 0]
+
+        # Find difference (movement)
+        cv2.absdiff(prev, cur, diff)
+        ti = cv2.meanStdDev(diff)[1][0, 0]
+        return si, ti
+    
+    # Go through all frames
+    for new_gray in frames:
+        frame_num = frame_num + 1
+        
+        if count == capacity:
+            capacity *= 2
+            si_values = np.resize(si_values, capacity)
+            ti_values = np.resize(ti_values, capacity)
+        
+        if opencl:
+            # Upload once per frame; the previous upload is kept as the TI reference
+            new_umat = cv2.UMat(new_gray)
+            mag = cv2.magnitude(cv2.Sobel(new_umat, cv2.CV_32F, 1, 0), cv2.Sobel(new_umat, cv2.CV_32F, 0, 1))
+            # On a UMat, meanStdDev returns UMats too; get() downloads the 1x1 results
+            si = cv2.meanStdDev(mag)[1].get()[0, 0]
+            ti = cv2.meanStdDev(cv2.absdiff(old_umat, new_umat))[1].get()[0, 0]
+            old_umat = new_umat
+            if count == 0:
+                # Some OpenCL drivers get the math wrong, so the first pair is checked against the CPU
+                cpu_si, cpu_ti = cpu_siti(old_gray, new_gray)
+                if not (np.isclose(si, cpu_si, rtol=OPENCL_RTOL, atol=OPENCL_RTOL) and np.isclose(ti, cpu_ti, rtol=OPENCL_RTOL, atol=OPENCL_RTOL)):
+                    print(f"OpenCL SI/TI ({si:.4f}, {ti:.4f}) differ from the CPU ({cpu_si:.4f}, {cpu_ti:.4f}), computing SI/TI on the CPU.")
+                    opencl = False
+                    si, ti = cpu_si, cpu_ti
+        elif approx:
+            # int16 Sobel and |dx| + |dy| stay in integer SIMD code at half the bandwidth of float32
+            cv2.Sobel(new_gray, cv2.CV_16S, 1, 0, dst=grad_x16)
+            cv2.Sobel(new_gray, cv2.CV_16S, 0, 1, dst=grad_y16)
+            np.abs(grad_x16, out=grad_x16)
+            np.abs(grad_y16, out=grad_y16)
+            np.add(grad_x16, grad_y16, out=grad_x16)  # at most 2 * 1020, so no int16 overflow
+            si = cv2.meanStdDev(grad_x16)[1][0, 0]
+
+            cv2.absdiff(old_gray, new_gray, diff)
+            ti = cv2.meanStdDev(diff)[1][0, 0]
+        elif has_numba:
+            # Edges (complexity) and difference (movement) in one fused pass
+            si, ti = si_ti_kernel(old_gray, new_gray)
+        else:
+            si, ti = cpu_siti(old_gray, new_gray)
+        
+        si_values[count] = si
+        ti_values[count] = ti
+        count += 1
+        
+        # Show progress
+        if frame_num % 100 == 0:
+            print("Processed " + str(frame_num) + " frames.")
+        
+        old_gray = new_gray
+    
+    return si_values[:count].copy(), ti_values[:count].copy()
+
+
+@functools.lru_cache(maxsize=None)
+def _analyze(path, mtime_ns, hwdec, opencl, approx):
+    # Each decoder and SI/TI path gets its own entry, so a result never stands in for another path's
+    decoder = "hwdec" if hwdec else "pyav" if has_pyav else "cv2"
+    method = "opencl" if opencl else "approx" if approx else "exact"
+    cache_key = hashlib.sha1(f"{CACHE_VERSION}:{path}:{mtime_ns}:{decoder}:{method}".encode("utf-8")).hexdigest()
+    cache_path = CACHE_DIR / f"{cache_key}.npz"
+    try:
+        with np.load(cache_path) as cached:
+            return cached["si"], cached["ti"]
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        # Missing, truncated or unreadable entries are treated as a miss and recomputed
+        pass
+
+    cap = cv2.VideoCapture(path)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    si, ti = compute_siti(path, width, height, hwdec, frame_count, opencl, approx)
+    if si.size:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Workers analyse in parallel, so each writes its own temp file and renames it into place
+        with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix=".tmp", delete=False) as f:
+            np.savez(f, si=si, ti=ti)
+        os.replace(f.name, cache_path)
+    return si, ti
+
+
+def analyze(video_path, hwdec=False, opencl=False, approx=False):
+    """Returns per-frame (SI, TI) arrays for the video.
+    Results are memoised per (path, mtime) in memory and in CACHE_DIR."""
+    video_path = Path(video_path)
+    return _analyze(str(video_path.resolve()), video_path.stat().st_mtime_ns, hwdec, opencl, approx)
@@ -1,41 +1,13 @@
-import os
-import subprocess
 from pathlib import Path
 
+import upscale_core
+
 INPUT_DIR = Path("av1_encoded_videos")
 OUTPUT_DIR = Path("upscaled_av1")
-SUPPORTED_EXTENSIONS = [".mp4", ".mkv", ".webm"]
-
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-
-def upscale_to_4k(input_path: Path, output_path: Path):
-    if output_path.exists():
-        print(f"[SKIP] Already upscaled: {output_path.name}")
-        return
-    print(f"[UPSCALE] {input_path.name} → {output_path.name}")
-    cmd = [
-        "ffmpeg", "-y",
-        "-i", str(input_path),
-        "-c:v", "libx265",
-        "-crf", "0",
-        "-vf", "scale=-2:2160:flags=lanczos",
-        "-preset", "faster",
-        "-pix_fmt", "yuv420p",
-        str(output_path)
-    ]
-    try:
-        subprocess.run(cmd, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"[ERROR] Failed to upscale {input_path.name}: {e}")
-
-def main():
-    for video_file in INPUT_DIR.glob("*"):
-        if video_file.suffix.lower() not in SUPPORTED_EXTENSIONS:
-            print(f"[SKIP] Unsupported format: {video_file.name}")
-            continue
 
-        output_file = OUTPUT_DIR / f"{video_file.stem}_upscaled_4k.mp4"
-        upscale_to_4k(video_file, output_file)
+def main(workers=None, use_hw=False):
+    """Upscales every AV1 encode to 4K; the pipeline itself lives in upscale_core"""
+    upscale_core.main(INPUT_DIR, OUTPUT_DIR, workers, use_hw)
 
 if __name__ == "__main__":
-    main()
+    upscale_core.run_cli(INPUT_DIR, OUTPUT_DIR)
@@ -0,0 +1,164 @@
+import argparse
+import os
+import re
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from video_probe import PHYSICAL_CORES
+
+SUPPORTED_EXTENSIONS = [".mp4", ".mkv", ".webm"]
+# Threads given to each ffmpeg process when upscales run in parallel
+THREADS_PER_JOB = 4
+
+# 4K upscale filters: zscale (libzimg, AVX2/AVX-512) when available, swscale otherwise
+ZSCALE_FILTER = "zscale=w=-2:h=2160:filter=lanczos,format=yuv420p"
+SWSCALE_FILTER = "scale=-2:2160:flags=lanczos"
+
+# Hardware HEVC encoders for GPU-resident upscaling, in order of preference
+HW_ENCODERS = ["hevc_nvenc", "hevc_vaapi"]
+VAAPI_DEVICE = "/dev/dri/renderD128"
+# Constant QP of the GPU upscale, shared by every codec so none is favoured in the VMAF comparison
+HW_UPSCALE_QP = 18
+
+TARGET_HEIGHT = 2160
+# Encoded files are named <source>_<codec>_<height>p_qp<qp>
+RESOLUTION_PATTERN = re.compile(r"_(\d+)p_qp\d+$")
+
+def pick_scale_filter():
+    """Prefers libzimg's SIMD zscale over swscale's Lanczos when ffmpeg is built with it"""
+    try:
+        result = subprocess.run(["ffmpeg", "-hide_banner", "-filters"], capture_output=True, text=True)
+        if " zscale " in result.stdout:
+            return ZSCALE_FILTER
+    except Exception:
+        pass
+    return SWSCALE_FILTER
+
+def pick_hw_upscale():
+    """Returns (input args, video filter, codec args) for a GPU decode/scale/encode chain, or None"""
+    try:
+        encoders = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True).stdout
+        filters = subprocess.run(["ffmpeg", "-hide_banner", "-filters"], capture_output=True, text=True).stdout
+    except Exception:
+        return None
+
+    encoder = next((name for name in HW_ENCODERS if name in encoders), None)
+    if encoder == "hevc_nvenc":
+        # scale_npp needs libnpp; scale_cuda ships with every CUDA-enabled build
+        scaler = "scale_npp" if " scale_npp " in filters else "scale_cuda"
+        return (
+            ["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"],
+            f"{scaler}=-2:2160:interp_algo=lanczos",
+            ["-c:v", "hevc_nvenc", "-preset", "p7", "-rc", "constqp", "-qp", str(HW_UPSCALE_QP)]
+        )
+    if encoder == "hevc_vaapi":
+        return (
+            ["-vaapi_device", VAAPI_DEVICE],
+            "format=nv12,hwupload,scale_vaapi=w=-2:h=2160",
+            ["-c:v", "hevc_vaapi", "-rc_mode", "CQP", "-qp", str(HW_UPSCALE_QP)]
+        )
+    return None
+
+def get_resolution_from_filename(path: Path):
+    """Returns the encoded height parsed from the filename, or None"""
+    match = RESOLUTION_PATTERN.search(path.stem)
+    return int(match.group(1)) if match else None
+
+def upscale_to_4k(input_path: Path, output_path: Path, threads: int = THREADS_PER_JOB, scale_filter: str = SWSCALE_FILTER, hw_args: tuple = None):
+    # ffmpeg writes to <name>.part, renamed only on success, so a failed or interrupted
+    # run never leaves a file that the next run would skip as already upscaled
+    part_path = output_path.with_name(output_path.name + ".part")
+    if get_resolution_from_filename(input_path) == TARGET_HEIGHT:
+        # Already 4K: remux instead of re-encoding an identity scale
+        print(f"[COPY] {input_path.name} → {output_path.name}")
+        cmd = ["ffmpeg", "-y", "-loglevel", "error", "-nostats", "-i", str(input_path), "-c", "copy", "-f", "mp4", str(part_path)]
+        try:
+            subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+            os.replace(part_path, output_path)
+        except subprocess.CalledProcessError as e:
+            print(f"[ERROR] Failed to copy {input_path.name}: {e}")
+            part_path.unlink(missing_ok=True)
+        return
+    print(f"[UPSCALE] {input_path.name} → {output_path.name}")
+    if hw_args:
+        input_args, video_filter, codec_args = hw_args
+        cmd = [
+            "ffmpeg", "-y", "-loglevel", "error", "-nostats",
+            *input_args,
+            "-i", str(input_path),
+            "-vf", video_filter,
+            *codec_args,
+            "-f", "mp4",
+            str(part_path)
+        ]
+    else:
+        cmd = [
+            "ffmpeg", "-y", "-loglevel", "error", "-nostats",
+            "-threads", str(threads),
+            "-i", str(input_path),
+            "-c:v", "libx265",
+            "-crf", "0",
+            "-x265-params", f"pools={threads}",
+            "-vf", scale_filter,
+            "-preset", "faster",
+            "-pix_fmt", "yuv420p",
+            "-f", "mp4",
+            str(part_path)
+        ]
+    try:
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+        os.replace(part_path, output_path)
+    except subprocess.CalledProcessError as e:
+        print(f"[ERROR] Failed to upscale {input_path.name}: {e}")
+        part_path.unlink(missing_ok=True)
+
+def upscale_job(job):
+    upscale_to_4k(*job)
+
+def main(input_dir, output_dir, workers=None, use_hw=False):
+    """Upscales every supported video of input_dir to <stem>_upscaled_4k.mp4 in output_dir"""
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # One directory listing instead of a stat() per prospective output
+    existing = {entry.name for entry in os.scandir(output_dir) if entry.is_file()}
+
+    jobs = []
+    for video_file in input_dir.glob("*"):
+        if video_file.suffix.lower() not in SUPPORTED_EXTENSIONS:
+            print(f"[SKIP] Unsupported format: {video_file.name}")
+            continue
+
+        output_file = output_dir / f"{video_file.stem}_upscaled_4k.mp4"
+        if output_file.name in existing:
+            print(f"[SKIP] Already upscaled: {output_file.name}")
+            continue
+        jobs.append((video_file, output_file))
+
+    if not jobs:
+        return
+
+    cpu_count = PHYSICAL_CORES
+    workers = max(1, min(workers or cpu_count // THREADS_PER_JOB, len(jobs)))
+    threads = max(1, cpu_count // workers)
+    hw_args = pick_hw_upscale() if use_hw else None
+    if hw_args:
+        print(f"[INFO] Upscaling on the GPU with {hw_args[2][1]}")
+        scale_filter = None
+    else:
+        if use_hw:
+            print("[WARNING] No hardware HEVC encoder found, falling back to CPU upscaling")
+        scale_filter = pick_scale_filter()
+        print(f"[INFO] Upscaling with {scale_filter.split('=')[0]}")
+    jobs = [job + (threads, scale_filter, hw_args) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(upscale_job, jobs))
+
+def run_cli(input_dir, output_dir):
+    """Command line shared by the per-codec upscale scripts"""
+    parser = argparse.ArgumentParser(description=f"Upscale videos in {input_dir} to 4K")
+    parser.add_argument("--jobs", type=int, default=None, help="number of parallel upscales (default: CPU cores / THREADS_PER_JOB)")
+    parser.add_argument("--hw", action="store_true", help="decode, scale and encode on the GPU (NVENC/VAAPI) if available")
+    args = parser.parse_args()
+    main(input_dir, output_dir, workers=args.jobs, use_hw=args.hw)
@@ -1,78 +1,109 @@
+import argparse
 import subprocess
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import os
 
+from upscale_core import SWSCALE_FILTER, TARGET_HEIGHT, get_resolution_from_filename, pick_scale_filter
+from video_probe import PHYSICAL_CORES
+
 # Define paths
 INPUT_DIR = Path("vvc_encoded_videos")
-Y4M_DIR = Path("decoded_y4m")
 OUTPUT_DIR = Path("upscaled_vvc")
 VVDECAPP_PATH = r"vvc_build\vvdec\bin\release-static\vvdecapp.exe"
 
+# Threads given to each vvdecapp/ffmpeg process when files run in parallel
+THREADS_PER_JOB = 4
+
 # Create necessary directories
-Y4M_DIR.mkdir(parents=True, exist_ok=True)
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def decode_vvc_to_y4m(vvc_path, y4m_path):
-    """Decode VVC to Y4M using vvdecapp with --y4m."""
-    cmd = [
+def upscale_vvc_file(vvc_file, threads=THREADS_PER_JOB, scale_filter=SWSCALE_FILTER):
+    """Decode a VVC file and upscale it to 4K, piping vvdecapp's Y4M output straight into ffmpeg.
+    Runs inside a worker process."""
+    output_path = OUTPUT_DIR / (vvc_file.stem + ".mkv")
+    # ffmpeg writes <name>.mkv.part, renamed on success, so a killed or crashed worker never leaves a finished-looking file
+    part_path = output_path.with_name(output_path.name + ".part")
+
+    decode_cmd = [
         VVDECAPP_PATH,
-        "-b", str(vvc_path),
+        "-b", str(vvc_file),
+        "-t", str(threads),
+        "-v", "0",
         "--y4m",
-        "-o", str(y4m_path)
+        "-o", "-"
     ]
-    print(f"[DECODING] {vvc_path.name} → {y4m_path.name}")
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise RuntimeError(f"vvdecapp failed:\n{result.stderr}")
-
-def encode_y4m_to_mp4(y4m_path, output_path):
-    """Convert Y4M to MP4 using ffmpeg with libx265."""
-    cmd = [
-        "ffmpeg", "-y",
-        "-i", str(y4m_path),
+    encode_cmd = [
+        "ffmpeg", "-y", "-loglevel", "error", "-nostats",
+        "-threads", str(threads),
+        "-f", "yuv4mpegpipe",
+        "-i", "-",
         "-c:v", "libx265",
+        "-x265-params", f"pools={threads}",
         "-preset", "faster",
-        "-vf", "scale=-2:2160:flags=lanczos",
-        "-crf", "0",  
-        str(output_path)
+        "-crf", "0",
+        "-f", "matroska",
+        str(part_path)
     ]
-    print(f"[ENCODING] {output_path.name}")
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise RuntimeError(f"ffmpeg failed:\n{result.stderr}")
+    already_4k = get_resolution_from_filename(vvc_file) == TARGET_HEIGHT
+    if not already_4k:
+        encode_cmd[-3:-3] = ["-vf", scale_filter]
+
+    print(f"[{'DECODE' if already_4k else 'UPSCALE'}] {vvc_file.name} → {output_path.name}")
+    decoder = None
+    try:
+        decoder = subprocess.Popen(decode_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        encoder = subprocess.run(encode_cmd, stdin=decoder.stdout, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        decoder.stdout.close()
+        decoder_stderr = decoder.stderr.read().decode("utf-8", errors="replace")
+        decoder.wait()
+
+        if decoder.returncode != 0:
+            raise RuntimeError(f"vvdecapp failed:\n{decoder_stderr}")
+        if encoder.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed:\n{encoder.stderr}")
+        os.replace(part_path, output_path)
+        print(f"[SUCCESS] {output_path.name}")
+    except Exception as e:
+        print(f"[ERROR] {vvc_file.name}: {e}")
+        if decoder is not None:
+            # ffmpeg may have failed first; don't leave vvdecapp blocked on a pipe nobody reads
+            if decoder.poll() is None:
+                decoder.kill()
+            decoder.stdout.close()
+            decoder.stderr.close()
+            decoder.wait()
+        part_path.unlink(missing_ok=True)
 
-def process_vvc_files():
+def process_vvc_files(workers=None):
     """Process all VVC files in the input directory."""
     vvc_files = list(INPUT_DIR.glob("*.vvc"))
     if not vvc_files:
         print(f"[ERROR] No VVC files found in {INPUT_DIR}")
         return
+
+    # One directory listing instead of a stat() per prospective output
+    existing = {entry.name for entry in os.scandir(OUTPUT_DIR) if entry.is_file()}
+    for vvc_file in [f for f in vvc_files if f.stem + ".mkv" in existing]:
+        print(f"[SKIP] {vvc_file.stem}.mkv already exists")
+        vvc_files.remove(vvc_file)
+    if not vvc_files:
+        return
     
     print(f"[INFO] Found {len(vvc_files)} VVC files to process")
-    
-    for vvc_file in vvc_files:
-        y4m_path = Y4M_DIR / (vvc_file.stem + ".y4m")
-        output_path = OUTPUT_DIR / (vvc_file.stem + ".mkv") 
-        
-        if output_path.exists():
-            print(f"[SKIP] {output_path.name} already exists")
-            continue
-        
-        try:
-            decode_vvc_to_y4m(vvc_file, y4m_path)
-            encode_y4m_to_mp4(y4m_path, output_path)
-            print(f"[SUCCESS] {output_path.name}")
-        except Exception as e:
-            print(f"[ERROR] {vvc_file.name}: {e}")
-        finally:
-            # Clean up Y4M file to save space
-            if y4m_path.exists():
-                try:
-                    os.remove(y4m_path)
-                    print(f"[CLEANUP] Removed {y4m_path.name}")
-                except:
-                    print(f"[WARNING] Could not remove {y4m_path.name}")
+
+    cpu_count = PHYSICAL_CORES
+    workers = max(1, min(workers or cpu_count // THREADS_PER_JOB, len(vvc_files)))
+    threads = max(1, cpu_count // workers)
+    scale_filter = pick_scale_filter()
+    print(f"[INFO] Upscaling with {scale_filter.split('=')[0]}")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(upscale_vvc_file, vvc_files, [threads] * len(vvc_files), [scale_filter] * len(vvc_files)))
 
 if __name__ == "__main__":
-    process_vvc_files()
+    parser = argparse.ArgumentParser(description="Decode VVC files and upscale them to 4K")
+    parser.add_argument("--jobs", type=int, default=None, help="number of parallel files (default: CPU cores / THREADS_PER_JOB)")
+    args = parser.parse_args()
+    process_vvc_files(workers=args.jobs)
@@ -0,0 +1,70 @@
+import functools
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+
+# Encoders, decoders, scalers and libvmaf gain nothing from SMT siblings, so every script budgets threads per physical core
+try:
+    import psutil
+    PHYSICAL_CORES = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+except ImportError:
+    PHYSICAL_CORES = os.cpu_count() or 1
+
+# Probe results are persisted here so reruns of any script skip ffprobe entirely
+CACHE_DIR = Path(".probe_cache")
+# Bump when the cached fields change so stale entries are ignored
+CACHE_VERSION = 3
+
+def _parse_rate(rate):
+    """Converts an ffprobe rate such as '30000/1001' to a float"""
+    if "/" in rate:
+        num, denom = map(int, rate.split("/"))
+        return num / denom if denom else 0.0
+    return float(rate)
+
+@functools.lru_cache(maxsize=None)
+def _probe(path, mtime_ns):
+    cache_key = hashlib.sha1(f"{CACHE_VERSION}:{path}:{mtime_ns}".encode("utf-8")).hexdigest()
+    cache_path = CACHE_DIR / f"{cache_key}.json"
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Missing, truncated or unreadable entries are treated as a miss and re-probed
+        pass
+
+    result = subprocess.run([
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,r_frame_rate,avg_frame_rate,duration:format=duration",
+        "-of", "json",
+        path
+    ], capture_output=True, text=True, check=True)
+    data = json.loads(result.stdout)
+
+    stream = data["streams"][0]
+    duration = data.get("format", {}).get("duration") or stream.get("duration")
+    # avg_frame_rate is the true average for VFR sources; ffprobe reports "0/0" when unknown
+    fps = _parse_rate(stream.get("avg_frame_rate", "0/0")) or _parse_rate(stream["r_frame_rate"])
+    info = {
+        "fps": round(fps, 6),
+        "duration": round(float(duration), 3) if duration else None,
+        "width": stream.get("width"),
+        "height": stream.get("height")
+    }
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    # Scripts probe concurrently, so each writer gets its own temp file and renames it into place
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=CACHE_DIR, suffix=".tmp", delete=False) as f:
+        json.dump(info, f)
+    os.replace(f.name, cache_path)
+    return info
+
+def probe(filepath):
+    """Returns {"fps", "duration", "width", "height"} for the first video stream, using one ffprobe call.
+    Results are memoised per (path, mtime) in memory and in CACHE_DIR."""
+    filepath = Path(filepath)
+    return dict(_probe(str(filepath.resolve()), filepath.stat().st_mtime_ns))
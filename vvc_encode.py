@@ -1,21 +1,77 @@
 import subprocess
+import tempfile
+import argparse
+import functools
 import json
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 import os
+import re
+
+from video_probe import PHYSICAL_CORES, probe
 
 # Define input and output directories
 INPUT_DIR = Path("video_source")
 OUTPUT_DIR = Path("vvc_encoded_videos")
-TEMP_DIR = Path("temp_yuv")
 
 # Create directories if they don't exist
 INPUT_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR.mkdir(exist_ok=True)
-TEMP_DIR.mkdir(exist_ok=True)
+
+VIDEO_EXTENSIONS = frozenset(['.mp4', '.mkv', '.avi', '.mov', '.webm'])
 
 # Path to vvencapp
 VVENCAPP_PATH = r"vvc_build\vvenc\bin\release-static\vvencapp.exe"
 
+# vvenc presets, fastest first; 1.9 retuned them (faster got ~15% quicker for ~1% BD-rate)
+PRESETS = ["faster", "fast", "medium", "slow", "slower"]
+DEFAULT_PRESET = "faster"
+MIN_VVENC_VERSION = (1, 9)
+
+# ffmpeg built with --enable-libvvenc runs the same encoder in-process, without the Y4M pipe
+try:
+    HAS_LIBVVENC = "libvvenc" in subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True).stdout
+except Exception:
+    HAS_LIBVVENC = False
+
+# Threads given to each ffmpeg/vvencapp process when encodes run in parallel
+THREADS_PER_JOB = 4
+
+# Frames vvenc encodes concurrently; without it extra threads only parallelise within a frame
+MAX_PARALLEL_FRAMES = 4
+
+# Intra period in seconds; set explicitly so vvenc places I-frames by the real frame rate
+REFRESH_SEC = 2
+
+# Needed for the 2160p memory gate below
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# A 2160p vvenc encode can reach ~8 GB RSS; 2160p jobs wait until this much RAM per encoder is free
+# (needs psutil; without it jobs are only bounded by --jobs)
+RAM_PER_2160P_ENCODE = 10 * 1024 ** 3
+
+# Seconds between free-memory checks while a 2160p job is held back
+MEMORY_POLL_SEC = 5
+
+# Records the source and settings each output was encoded from, so stale outputs are redone
+MANIFEST_PATH = OUTPUT_DIR / ".manifest.json"
+
+# Concurrent ffprobe calls when reading the sources' frame rates
+PROBE_WORKERS = 8
+
+# Bytes of scaled Y4M read from ffmpeg and written to every encoder per step
+TEE_CHUNK_SIZE = 1024 * 1024
+
+# Linux pipes default to 64 KiB; growing them to the chunk size cuts context switches per 4K frame
+try:
+    import fcntl
+    F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+except ImportError:
+    fcntl = None
+
 # Resolution → QP values
 QP_MAPPING = {
     360: [24, 30],
@@ -26,61 +82,295 @@ QP_MAPPING = {
 
 def get_video_properties(video_path):
     """Extract framerate from input video using ffprobe."""
-    cmd = [
-        "ffprobe", "-v", "error",
-        "-select_streams", "v:0",
-        "-show_entries", "stream=r_frame_rate",
-        "-of", "json",
-        str(video_path)
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-    props = json.loads(result.stdout)["streams"][0]
-    num, den = map(int, props["r_frame_rate"].split('/'))
-    framerate = round(num / den)
-    return framerate
-
-def encode_vvc(input_path, resolution, qp, framerate):
-    """Encode video into VVC using vvencapp with scaling and naming."""
-    output_name = f"{input_path.stem}_vvc_{resolution}p_qp{qp}.vvc"
-    output_path = OUTPUT_DIR / output_name
-
-    if output_path.exists():
-        print(f"[SKIP] {output_path.name} already exists")
+    return round(probe(video_path)["fps"])
+
+@functools.lru_cache(maxsize=1)
+def check_vvencapp():
+    """Checks that vvencapp runs and returns its version string ("unknown" if unparsable), or None.
+    Warns if it predates the 1.9 presets."""
+    try:
+        result = subprocess.run([VVENCAPP_PATH, "--version"], capture_output=True, text=True)
+    except OSError:
+        print(f"[ERROR] vvencapp not found at {VVENCAPP_PATH}")
+        return None
+    match = re.search(r"(\d+)\.(\d+)(?:\.\d+)?", result.stdout + result.stderr)
+    if not match:
+        return "unknown"
+    if (int(match.group(1)), int(match.group(2))) < MIN_VVENC_VERSION:
+        print(f"[WARNING] vvencapp {match.group(0)} predates the faster {'.'.join(map(str, MIN_VVENC_VERSION))} presets; consider upgrading")
+    return match.group(0)
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest):
+    """Writes the manifest atomically so an interrupted run never leaves it half-written"""
+    # A unique temp file, so a scheduler.py and a vvc_encode.py run never write through the same one
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=OUTPUT_DIR, suffix=".tmp", delete=False) as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(f.name, MANIFEST_PATH)
+
+def output_signature(input_file, resolution, qp, preset, encoder):
+    """What an output depends on: the source's identity plus every encode setting"""
+    stat = input_file.stat()
+    return [stat.st_mtime_ns, stat.st_size, resolution, qp, preset, encoder]
+
+def pending_encodes(input_file, preset, encoder_id, manifest, existing, signatures):
+    """Returns {resolution: [qp]} still to encode for input_file and records their signatures.
+    Outputs recorded with another source state or settings are redone; unrecorded ones are kept.
+    A stale output stays in place until its re-encode succeeds and replaces it."""
+    pending = {}
+    for resolution, qp_list in QP_MAPPING.items():
+        pending[resolution] = []
+        for qp in qp_list:
+            output_name = f"{input_file.stem}_vvc_{resolution}p_qp{qp}.vvc"
+            signature = output_signature(input_file, resolution, qp, preset, encoder_id)
+            if output_name in existing:
+                if manifest.get(output_name, signature) == signature:
+                    continue
+                print(f"[STALE] {output_name} was encoded from another source version or settings")
+            signatures[output_name] = signature
+            pending[resolution].append(qp)
+    return pending
+
+def staging_path(output_path):
+    """Encoders write to <name>.part, renamed on success, so an interrupted encode never looks finished"""
+    return output_path.with_name(output_path.name + ".part")
+
+def enlarge_pipe(pipe, size=TEE_CHUNK_SIZE):
+    """Grows a pipe's kernel buffer on Linux; a no-op elsewhere or if the system limit is lower"""
+    if fcntl is None:
         return
+    try:
+        fcntl.fcntl(pipe.fileno(), F_SETPIPE_SZ, size)
+    except OSError:
+        pass
+
+def job_memory(resolution, encodes):
+    """RAM reserved for a job: RAM_PER_2160P_ENCODE per 2160p encode, nothing below 2160p"""
+    return RAM_PER_2160P_ENCODE * encodes if resolution >= 2160 else 0
+
+def running_encoder_memory():
+    """RSS of this run's 2160p encoders (vvencapp or libvvenc ffmpeg), found by their output names"""
+    total = 0
+    for child in psutil.Process().children(recursive=True):
+        try:
+            if any("_vvc_2160p_" in arg for arg in child.cmdline()):
+                total += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
 
-    print(f"[ENCODE] {input_path.name} → {output_path.name} @QP{qp}, {resolution}p")
+def fits_in_memory(need, reserved):
+    """Whether a job needing `need` bytes can start beside running jobs that reserved `reserved`.
+    Memory those encoders already hold is part of their reservation, so it is added back to what is
+    available rather than counted twice. With nothing reserved a job always starts."""
+    if not need or not reserved or psutil is None:
+        return True
+    return psutil.virtual_memory().available + min(running_encoder_memory(), reserved) >= reserved + need
+
+def encode_vvc(input_path, resolution, qp_list, framerate, threads=THREADS_PER_JOB, preset=DEFAULT_PRESET):
+    """Encode video into VVC at one resolution and every QP of qp_list.
+    ffmpeg decodes and scales the source once; its Y4M stream is teed into one vvencapp per QP.
+    Returns [(output_name, status, error_msg)] like the other encoder scripts."""
+    # qp_list comes from pending_encodes, so an existing output here is stale and is replaced on success
+    outputs = []
+    for qp in qp_list:
+        output_name = f"{input_path.stem}_vvc_{resolution}p_qp{qp}.vvc"
+        outputs.append((qp, output_name, staging_path(OUTPUT_DIR / output_name)))
+
+    if not outputs:
+        return []
+
+    print(f"[ENCODE] {input_path.name} → {resolution}p @QP {', '.join(str(qp) for qp, _, _ in outputs)}")
 
     # Calculate width while maintaining aspect ratio from 1080p
     width = int(1920 * resolution / 1080)
     width += width % 2  # Ensure width is even
 
-    # Create a temporary YUV file
-    temp_yuv = TEMP_DIR / f"{input_path.stem}_{resolution}p.yuv"
-    
+    # The encoders of one resolution run side by side and share the job's threads
+    encoder_threads = max(1, threads // len(outputs))
+
+    # ffmpeg scales and streams Y4M straight into vvencapp, so no raw YUV is written to disk
+    ffmpeg_cmd = [
+        "ffmpeg", "-loglevel", "error", "-nostats",
+        "-threads", str(threads),
+        "-filter_threads", str(threads),  # Slice-threaded scaling keeps up with the encoders reading the pipe
+        "-i", str(input_path),
+        "-vf", f"scale={width}:{resolution}",
+        "-pix_fmt", "yuv420p10le",  # vvenc works at 10 bits internally; convert once here, not in every encoder
+        "-f", "yuv4mpegpipe",
+        "-"
+    ]
+
+    def vvenc_cmd(qp, part_path):
+        return [
+            VVENCAPP_PATH,
+            "-i", "-",
+            "--y4m",  # Frame size and bit depth come from the Y4M header
+            "--fps", str(framerate),
+            "--refreshsec", str(REFRESH_SEC),
+            "-q", str(qp),
+            "-o", str(part_path),
+            "--preset", preset,
+            "--threads", str(encoder_threads),
+            "--MaxParallelFrames", str(MAX_PARALLEL_FRAMES)
+        ]
+
+    scaler = None
+    encoders = []
     try:
-        # Step 1: Convert to YUV
-        ffmpeg_cmd = f'ffmpeg -i "{input_path}" -vf "scale={width}:{resolution}" -pix_fmt yuv420p "{temp_yuv}"'
-        subprocess.run(ffmpeg_cmd, shell=True, check=True)
-        
-        # Step 2: Encode YUV to VVC
-        vvenc_cmd = f'"{VVENCAPP_PATH}" -i "{temp_yuv}" -s {width}x{resolution} --fps {framerate} -q {qp} -o "{output_path}" --preset faster'
-        subprocess.run(vvenc_cmd, shell=True, check=True)
-        
-        print(f"[SUCCESS] Encoded {output_path.name}")
+        scaler = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=TEE_CHUNK_SIZE)
+        enlarge_pipe(scaler.stdout)
+        for qp, output_name, part_path in outputs:
+            # stderr goes to a file so an encoder can never block on a full pipe while being fed
+            stderr_file = tempfile.TemporaryFile()
+            process = subprocess.Popen(vvenc_cmd(qp, part_path), stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr_file)
+            enlarge_pipe(process.stdin)
+            encoders.append((process, stderr_file))
+
+        # Tee the scaled frames into every encoder; one that exits early is dropped, not waited on
+        live = [process for process, _ in encoders]
+        while live:
+            chunk = scaler.stdout.read(TEE_CHUNK_SIZE)
+            if not chunk:
+                break
+            for process in list(live):
+                try:
+                    process.stdin.write(chunk)
+                except (BrokenPipeError, OSError):
+                    live.remove(process)
+        for process, _ in encoders:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+        scaler.stdout.close()
+        if live:
+            scaler_stderr = scaler.stderr.read().decode("utf-8", errors="replace")
+            scaler.wait()
+        else:
+            # Every encoder failed; don't wait for ffmpeg to finish scaling for nobody
+            scaler.kill()
+            scaler.wait()
+            scaler_stderr = ""
+
+        results = []
+        for (process, stderr_file), (_, output_name, part_path) in zip(encoders, outputs):
+            process.wait()
+            if scaler.returncode != 0 and live:
+                error_msg = f"ffmpeg failed:\n{scaler_stderr}"
+            elif process.returncode != 0:
+                stderr_file.seek(0)
+                error_msg = f"vvencapp failed:\n{stderr_file.read().decode('utf-8', errors='replace')}"
+            else:
+                os.replace(part_path, OUTPUT_DIR / output_name)
+                results.append((output_name, "done", None))
+                continue
+            part_path.unlink(missing_ok=True)
+            results.append((output_name, "error", error_msg))
+        return results
     except Exception as e:
-        print(f"[ERROR] Failed to encode {output_path.name}: {e}")
-        if output_path.exists():
-            output_path.unlink()
+        # Stop the scaler too, or it blocks forever on a full stdout pipe nobody reads
+        processes = [process for process, _ in encoders]
+        if scaler is not None:
+            processes.append(scaler)
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            for pipe in (process.stdin, process.stdout, process.stderr):
+                if pipe is not None:
+                    try:
+                        pipe.close()
+                    except OSError:
+                        pass
+        for _, _, part_path in outputs:
+            part_path.unlink(missing_ok=True)
+        return [(output_name, "error", str(e)) for _, output_name, _ in outputs]
     finally:
-        # Clean up temp file
-        if temp_yuv.exists():
-            os.remove(temp_yuv)
+        for _, stderr_file in encoders:
+            stderr_file.close()
+
+def encode_vvc_libvvenc(input_path, resolution, qp_list, framerate, threads=THREADS_PER_JOB, preset=DEFAULT_PRESET):
+    """Same contract as encode_vvc, but one ffmpeg run scales once, splits the frames and
+    encodes every QP with libvvenc, writing raw .vvc bitstreams."""
+    # qp_list comes from pending_encodes, so an existing output here is stale and is replaced on success
+    outputs = []
+    for qp in qp_list:
+        output_name = f"{input_path.stem}_vvc_{resolution}p_qp{qp}.vvc"
+        outputs.append((qp, output_name, staging_path(OUTPUT_DIR / output_name)))
+
+    if not outputs:
+        return []
+
+    print(f"[ENCODE] {input_path.name} → {resolution}p @QP {', '.join(str(qp) for qp, _, _ in outputs)} (libvvenc)")
+
+    # Calculate width while maintaining aspect ratio from 1080p
+    width = int(1920 * resolution / 1080)
+    width += width % 2  # Ensure width is even
+
+    encoder_threads = max(1, threads // len(outputs))
+    graph = f"[0:v]scale={width}:{resolution},split={len(outputs)}" + "".join(f"[v{i}]" for i in range(len(outputs)))
+    output_args = []
+    for i, (qp, _, part_path) in enumerate(outputs):
+        output_args += [
+            "-map", f"[v{i}]",
+            "-c:v", "libvvenc",
+            "-pix_fmt", "yuv420p10le",  # libvvenc only takes 10-bit input
+            "-preset", preset,
+            "-qp", str(qp),
+            "-r", str(framerate),
+            "-threads", str(encoder_threads),
+            "-vvenc-params", f"MaxParallelFrames={MAX_PARALLEL_FRAMES}:RefreshSec={REFRESH_SEC}",
+            "-f", "vvc",
+            str(part_path)
+        ]
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error", "-nostats",
+        "-filter_complex_threads", str(threads),
+        "-i", str(input_path),
+        "-filter_complex", graph,
+        *output_args
+    ]
+
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace")
+    if result.returncode == 0:
+        for _, output_name, part_path in outputs:
+            os.replace(part_path, OUTPUT_DIR / output_name)
+        return [(output_name, "done", None) for _, output_name, _ in outputs]
 
-def main():
-    video_extensions = ['.mp4', '.mkv', '.avi', '.mov', '.webm']
-    video_files = []
-    for ext in video_extensions:
-        video_files.extend(INPUT_DIR.glob(f"*{ext}"))
+    # A failed run leaves every output of the command incomplete
+    for _, _, part_path in outputs:
+        part_path.unlink(missing_ok=True)
+    return [(output_name, "error", f"ffmpeg failed:\n{result.stderr[-4096:]}") for _, output_name, _ in outputs]
+
+def encode_job(job):
+    """Unpack a job tuple for executor.map."""
+    return encode_vvc(*job)
+
+def main(workers=None, use_libvvenc=False, preset=DEFAULT_PRESET):
+    if use_libvvenc and not HAS_LIBVVENC:
+        print("[WARNING] FFmpeg has no libvvenc encoder, falling back to vvencapp")
+        use_libvvenc = False
+    if use_libvvenc:
+        encoder_id = "libvvenc"
+    else:
+        vvenc_version = check_vvencapp()
+        if vvenc_version is None:
+            return
+        encoder_id = f"vvencapp {vvenc_version}"
+    encode = encode_vvc_libvvenc if use_libvvenc else encode_vvc
+
+    # One directory listing, filtered by extension, instead of a glob per extension
+    with os.scandir(INPUT_DIR) as entries:
+        video_files = sorted(Path(entry.path) for entry in entries
+                             if entry.is_file() and os.path.splitext(entry.name)[1].lower() in VIDEO_EXTENSIONS)
 
     if not video_files:
         print(f"[ERROR] No video files found in {INPUT_DIR}")
@@ -89,17 +379,90 @@ def main():
 
     print(f"[INFO] Found {len(video_files)} video files to encode")
 
+    # One directory listing instead of a stat() per prospective output
+    existing = {entry.name for entry in os.scandir(OUTPUT_DIR) if entry.is_file()}
+
+    manifest = load_manifest()
+    signatures = {}
+    pending_by_file = {}
     for input_file in video_files:
+        pending = pending_encodes(input_file, preset, encoder_id, manifest, existing, signatures)
+        if not any(pending.values()):
+            print(f"[SKIP] All encodes for {input_file.name} already exist")
+            continue
+        pending_by_file[input_file] = pending
+
+    def probe_framerate(input_file):
         try:
-            framerate = get_video_properties(input_file)
-            print(f"[INFO] Processing {input_file.name} (FPS: {framerate})")
+            return get_video_properties(input_file), None
         except Exception as e:
-            print(f"[ERROR] Failed to get video properties for {input_file.name}: {e}")
+            return None, e
+
+    # ffprobe startup dominates for short clips, so the sources are probed concurrently
+    with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as executor:
+        framerates = dict(zip(pending_by_file, executor.map(probe_framerate, pending_by_file)))
+
+    jobs = []
+    for input_file, pending in pending_by_file.items():
+        framerate, error = framerates[input_file]
+        if error is not None:
+            print(f"[ERROR] Failed to get video properties for {input_file.name}: {error}")
             continue
+        print(f"[INFO] Processing {input_file.name} (FPS: {framerate})")
+
+        # One job per resolution: the source is scaled once for all of its QPs
+        for resolution, qp_list in pending.items():
+            if qp_list:
+                jobs.append((input_file, resolution, qp_list, framerate))
+
+    if not jobs:
+        return
+
+    # Longest jobs first (pixels per frame x encodes sharing the scale), so 4K doesn't trail at the end
+    jobs.sort(key=lambda job: job[1] * job[1] * len(job[2]), reverse=True)
+
+    cpu_count = PHYSICAL_CORES
+    workers = max(1, min(workers or cpu_count // THREADS_PER_JOB, len(jobs)))
+    threads = max(1, cpu_count // workers)
+    jobs = [job + (threads, preset) for job in jobs]
+    total = sum(len(job[2]) for job in jobs)
+    print(f"[INFO] Running {total} encodes as {len(jobs)} jobs on {workers} workers, {threads} threads each")
+
+    # Jobs are handed out longest-first, but a 2160p job is only submitted once memory allows it;
+    # until then free workers take the smaller jobs queued behind it instead of idling
+    failed = 0
+    queue = list(jobs)
+    running = {}  # future -> RAM reserved for its job
+
+    # Each worker only waits on its ffmpeg/vvencapp processes, so threads are enough
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while queue or running:
+            while queue and len(running) < workers:
+                reserved = sum(running.values())
+                job = next((job for job in queue if fits_in_memory(job_memory(job[1], len(job[2])), reserved)), None)
+                if job is None:
+                    break
+                queue.remove(job)
+                running[executor.submit(encode, *job)] = job_memory(job[1], len(job[2]))
+
+            done, _ = wait(running, timeout=MEMORY_POLL_SEC, return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                for output_name, status, error_msg in future.result():
+                    if status == "done":
+                        manifest[output_name] = signatures[output_name]
+                        print(f"[SUCCESS] Encoded {output_name}")
+                    else:
+                        failed += 1
+                        print(f"[ERROR] Failed to encode {output_name}: {error_msg}")
+                save_manifest(manifest)
 
-        for resolution, qp_list in QP_MAPPING.items():
-            for qp in qp_list:
-                encode_vvc(input_file, resolution, qp, framerate)
+    print(f"[INFO] {total - failed} of {total} encodes succeeded")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Encode source videos with VVC (vvencapp)")
+    parser.add_argument("--jobs", type=int, default=None, help="number of parallel encodes (default: CPU cores / THREADS_PER_JOB)")
+    parser.add_argument("--libvvenc", action="store_true", help="encode through FFmpeg's libvvenc (one process per source and resolution) instead of vvencapp")
+    parser.add_argument("--preset", choices=PRESETS, default=DEFAULT_PRESET, help="vvenc preset (default: %(default)s; needs vvenc >= 1.9 for the retuned presets)")
+    args = parser.parse_args()
+    main(workers=args.jobs, use_libvvenc=args.libvvenc, preset=args.preset)